@@ -0,0 +1,47 @@
+import hashlib
+from typing import Annotated
+
+from fastapi import Depends, Request, Response, status
+
+# JSON reads may be stored but are revalidated with If-None-Match every time
+REVALIDATE = "private, no-cache"
+# a photo's file is never replaced, its bytes can be cached for good
+IMMUTABLE = "private, max-age=31536000, immutable"
+
+
+def make_etag(*parts) -> str:
+    return '"' + hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match uses the weak comparison
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+class Conditional:
+    # the ETag is computed from row versions before the payload is loaded
+    def __init__(self, request: Request, response: Response):
+        self.if_none_match = request.headers.get("if-none-match")
+        self.response = response
+
+    @property
+    def requested(self) -> bool:
+        return self.if_none_match is not None
+
+    @property
+    def headers(self) -> dict[str, str]:
+        return dict(self.response.headers)
+
+    def check(self, etag: str, cache_control: str = REVALIDATE) -> Response | None:
+        self.response.headers["ETag"] = etag
+        self.response.headers["Cache-Control"] = cache_control
+        if self.if_none_match and etag_matches(self.if_none_match, etag):
+            return Response(
+                status_code=status.HTTP_304_NOT_MODIFIED,
+                headers=self.headers,
+            )
+        return None
+
+
+ConditionalDep = Annotated[Conditional, Depends()]
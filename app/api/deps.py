@@ -1,12 +1,17 @@
+import time
 from typing import Annotated
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
+from sqlalchemy import event, inspect
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
 
+from app.core.cache import TTLCache
 from app.core.config import settings
 from app.core.exeptions import CredentialsException
+from app.db import models
 from app.db.crud import UserStorage as US
 from app.db.database import get_db_session
 from app.db.schemas import TokenData, User
@@ -16,11 +21,29 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/token")
 
 DBSessionDep = Annotated[AsyncSession, Depends(get_db_session)]
 
+# token -> subject of tokens whose signature was already verified
+token_subjects: TTLCache[str, str] = TTLCache(
+    max_size=settings.TOKEN_CACHE_MAX_SIZE,
+    ttl=settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+)
+# subject -> column values of the user, attached to each request session
+cached_users: TTLCache[str, dict] = TTLCache(
+    max_size=settings.USER_CACHE_MAX_SIZE, ttl=settings.USER_CACHE_TTL_SECONDS
+)
+USER_COLUMNS = [column.key for column in inspect(models.User).column_attrs]
 
-async def get_current_user(
-    session: DBSessionDep,
-    token: Annotated[str, Depends(oauth2_scheme)],
-):
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def invalidate_cached_user(mapper, connection, target: models.User):
+    for email in [target.email, *inspect(target).attrs.email.history.deleted]:
+        cached_users.pop(email)
+
+
+def get_token_data(token: str) -> TokenData:
+    email = token_subjects.get(token)
+    if email is not None:
+        return TokenData(email=email)
     try:
         payload = jwt.decode(
             token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
@@ -31,9 +54,29 @@ async def get_current_user(
         token_data = TokenData(email=email)
     except JWTError:
         raise CredentialsException
+    if "exp" in payload:
+        token_subjects.set(token, email, ttl=payload["exp"] - time.time())
+    return token_data
+
+
+async def get_current_user(
+    session: DBSessionDep,
+    token: Annotated[str, Depends(oauth2_scheme)],
+):
+    token_data = get_token_data(token)
+    values = cached_users.get(token_data.email)
+    if values is not None:
+        # attach without a query, so relationships like photo.uploaded_by
+        # still resolve to this instance through the identity map
+        user = models.User(**values)
+        make_transient_to_detached(user)
+        return await session.merge(user, load=False)
     user = await US.get_user_by_email(session, email=token_data.email)
     if user is None:
         raise CredentialsException
+    cached_users.set(
+        token_data.email, {column: getattr(user, column) for column in USER_COLUMNS}
+    )
     return user
 
 
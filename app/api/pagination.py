@@ -0,0 +1,36 @@
+import base64
+import binascii
+from typing import Annotated, Sequence
+
+from fastapi import Depends, HTTPException, Response, status
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+
+
+class Page:
+    # keyset pagination on id when a cursor is given, offset as a fallback
+    def __init__(self, offset: int = 0, limit: int = 100, cursor: str | None = None):
+        self.offset = offset
+        self.limit = limit
+        self.after_id = decode_cursor(cursor) if cursor else None
+
+    def respond(self, response: Response, items: Sequence) -> Sequence:
+        if items and len(items) == self.limit:
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(items[-1].id)
+        return items
+
+
+PageDep = Annotated[Page, Depends()]
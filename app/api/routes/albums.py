@@ -1,25 +1,50 @@
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Response, status
 
+from app.api import serialization
+from app.api.caching import ConditionalDep, make_etag
 from app.api.deps import DBSessionDep, get_current_active_user
+from app.api.pagination import PageDep
 from app.db.crud import AlbumStorage as AS
-from app.db.schemas import Album, AlbumCreate, AlbumUpdate, User
+from app.db.crud import PhotoStorage as PS
+from app.db.schemas import Album, AlbumCreate, AlbumShort, AlbumUpdate, User
 
 router = APIRouter()
 
 
-@router.get("/")
+@router.get("/", response_model=list[Album])
 async def get_user_albums_by_id(
     session: DBSessionDep,
     user_id: int,
-    offset: int = 0,
-    limit: int = 100,
+    page: PageDep,
+    response: Response,
+    conditional: ConditionalDep,
 ):
-    return await AS.get_user_albums(session, user_id, offset, limit)
+    # polled all the time, an unchanged page costs one aggregate query
+    if conditional.requested:
+        versions = await AS.get_user_album_versions(
+            session, user_id, page.offset, page.limit, page.after_id
+        )
+        page.respond(response, versions)
+        if not_modified := conditional.check(make_etag(*map(tuple, versions))):
+            return not_modified
+    rows = await AS.get_user_album_rows(
+        session, user_id, page.offset, page.limit, page.after_id
+    )
+    photo_rows = await AS.get_albums_photo_rows(session, [row.id for row in rows])
+    user_rows = await PS.get_photos_user_rows(session, [row.id for row in photo_rows])
+    photos_by_album = serialization.group_by(photo_rows, "album_id")
+    conditional.check(
+        make_etag(*(AS.album_version(row, photos_by_album[row.id]) for row in rows))
+    )
+    page.respond(response, rows)
+    return serialization.FastJSONResponse(
+        serialization.albums(rows, photo_rows, user_rows), headers=conditional.headers
+    )
 
 
-@router.post("/", status_code=status.HTTP_201_CREATED)
+@router.post("/", status_code=status.HTTP_201_CREATED, response_model=AlbumShort)
 async def create_album_to_user(
     session: DBSessionDep,
     user: Annotated[User, Depends(get_current_active_user)],
@@ -28,9 +53,21 @@ async def create_album_to_user(
     return await AS.create_album(session, owner=user, album=album)
 
 
-@router.get("/{album_id}")
-async def get_album_by_id(session: DBSessionDep, album_id: int):
-    return await AS.get_album(session, album_id)
+@router.get("/{album_id}", response_model=Album)
+async def get_album_by_id(
+    session: DBSessionDep, album_id: int, conditional: ConditionalDep
+):
+    if conditional.requested:
+        version = await AS.get_album_version(session, album_id)
+        if version and (not_modified := conditional.check(make_etag(tuple(version)))):
+            return not_modified
+    album = await AS.get_album_with_photos(session, album_id)
+    if not album:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+        )
+    conditional.check(make_etag(AS.album_version(album, album.photos)))
+    return album
 
 
 @router.delete("/{album_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -44,7 +81,7 @@ async def delete_album_by_id(
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
         )
-    if not album.owner == user:
+    if album.owner_id != user.id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You do not have permission to delete this photo",
@@ -52,7 +89,7 @@ async def delete_album_by_id(
     await AS.delete_album(session, album)
 
 
-@router.put("/{album_id}")
+@router.put("/{album_id}", response_model=AlbumShort)
 async def update_album_by_id(
     session: DBSessionDep,
     album_id: int,
@@ -64,7 +101,7 @@ async def update_album_by_id(
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
         )
-    if not album.owner == user:
+    if album.owner_id != user.id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You do not have permission to delete this photo",
@@ -1,23 +1,99 @@
+import asyncio
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile, status
+import numpy as np
+from fastapi import (
+    APIRouter,
+    Body,
+    Depends,
+    File,
+    Form,
+    HTTPException,
+    Response,
+    UploadFile,
+    status,
+)
+from fastapi.responses import FileResponse
+from PIL import Image, UnidentifiedImageError
 
+from app.api import serialization
+from app.api.caching import IMMUTABLE, ConditionalDep, make_etag
 from app.api.deps import DBSessionDep, get_current_active_user
-from app.db.crud import AlbumStorage, PhotoStorage
-from app.db.schemas import Photo, PhotoCreate, User
-from app.face_id.utils import is_one_person_on_photo, is_person_same
+from app.api.pagination import PageDep
+from app.core.config import settings
+from app.db.crud import (
+    AlbumStorage,
+    FaceClusterStorage,
+    FaceEmbeddingStorage,
+    PhotoStorage,
+    file_key,
+)
+from app.db.schemas import (
+    ClusterFace,
+    FaceBox,
+    FaceCluster,
+    FaceTag,
+    Photo,
+    PhotoConfirmation,
+    PhotoCreate,
+    PhotoIdentification,
+    PhotoProcessing,
+    PhotoUpload,
+    User,
+)
+from app.face_id.pipeline import ingestion_pipeline
+from app.face_id.service import (
+    confirm_user_photos,
+    get_photo_analysis,
+    get_user_prototype,
+    identify_photo,
+    index_faces,
+    link_users_to_photo,
+    photo_face_tags,
+    unindex_faces,
+)
+from app.face_id.utils import face_prototypes, is_one_person_on_photo, is_person_same
 
 router = APIRouter()
 
 
-@router.get("/")
+def check_image(file: UploadFile) -> str | None:
+    try:
+        with Image.open(file.file) as image:
+            image.verify()
+    except (UnidentifiedImageError, OSError):
+        return "Invalid image file"
+    finally:
+        file.file.seek(0)
+    return None
+
+
+@router.get("/", response_model=list[Photo])
 async def read_current_user_photos(
     session: DBSessionDep,
     user: Annotated[User, Depends(get_current_active_user)],
-    offset: int = 0,
-    limit: int = 100,
+    page: PageDep,
+    response: Response,
+    conditional: ConditionalDep,
 ):
-    return await PhotoStorage.get_user_photos(session, user, offset, limit)
+    if conditional.requested:
+        versions = await PhotoStorage.get_user_photo_versions(
+            session, user, page.offset, page.limit, page.after_id
+        )
+        page.respond(response, versions)
+        if not_modified := conditional.check(make_etag(*map(tuple, versions))):
+            return not_modified
+    rows = await PhotoStorage.get_user_photo_rows(
+        session, user, page.offset, page.limit, page.after_id
+    )
+    user_rows = await PhotoStorage.get_photos_user_rows(
+        session, [row.id for row in rows]
+    )
+    conditional.check(make_etag(*map(PhotoStorage.photo_version, rows)))
+    page.respond(response, rows)
+    return serialization.FastJSONResponse(
+        serialization.photos(rows, user_rows), headers=conditional.headers
+    )
 
 
 @router.post("/")
@@ -29,7 +105,50 @@ async def add_photo_to_current_user(
     file: Annotated[UploadFile, File()],
 ):
     photo_in = PhotoCreate(title=title, description=description, file=file)
-    return await PhotoStorage.create_photo(session, photo=photo_in, uploaded_by=user)
+    photo = await PhotoStorage.create_photo(session, photo=photo_in, uploaded_by=user)
+    ingestion_pipeline.submit(photo.id)
+    return photo
+
+
+@router.post("/batch", response_model=list[PhotoUpload])
+async def add_photos_to_current_user(
+    session: DBSessionDep,
+    user: Annotated[User, Depends(get_current_active_user)],
+    files: Annotated[list[UploadFile], File()],
+    description: Annotated[str, Form()] = "",
+):
+    if len(files) > settings.PHOTO_BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.PHOTO_BATCH_MAX_FILES} files per batch",
+        )
+    # broken files are reported per file instead of failing the whole insert
+    errors = await asyncio.to_thread(lambda: [check_image(file) for file in files])
+    photos_in = [
+        PhotoCreate(title=file.filename or "", description=description, file=file)
+        for file, error in zip(files, errors)
+        if error is None
+    ]
+    photos = iter(
+        await PhotoStorage.create_photos(session, photos_in, uploaded_by=user)
+    )
+    results = []
+    for file, error in zip(files, errors):
+        if error is not None:
+            results.append(PhotoUpload(filename=file.filename, error=error))
+            continue
+        photo = next(photos)
+        # the pipeline workers share the face engine pool across the batch
+        ingestion_pipeline.submit(photo.id)
+        results.append(
+            PhotoUpload(
+                filename=file.filename,
+                id=photo.id,
+                file=photo.file,
+                processing_status=photo.processing_status,
+            )
+        )
+    return results
 
 
 @router.get("/only-created-by-current-user")
@@ -41,15 +160,108 @@ async def get_photos_there_only_owner(
     return photos
 
 
+@router.get("/faces/clusters", response_model=list[FaceCluster])
+async def get_face_clusters(
+    session: DBSessionDep,
+    user: Annotated[User, Depends(get_current_active_user)],
+    min_size: int = settings.FACE_CLUSTER_MIN_SIZE,
+):
+    # filled by the clustering job, faces of confirmed photos drop out
+    clusters: dict[int, list[ClusterFace]] = {}
+    for face in await FaceClusterStorage.get_cluster_faces(session, user.id):
+        clusters.setdefault(face.cluster_id, []).append(
+            ClusterFace(
+                face_id=face.id,
+                photo_id=face.photo_id,
+                box=FaceBox(
+                    top=face.top, right=face.right, bottom=face.bottom, left=face.left
+                ),
+            )
+        )
+    return sorted(
+        (
+            FaceCluster(id=cluster_id, size=len(faces), faces=faces)
+            for cluster_id, faces in clusters.items()
+            if len(faces) >= min_size
+        ),
+        key=lambda cluster: -cluster.size,
+    )
+
+
+@router.patch(
+    "/faces/clusters/{cluster_id}/set-it-is-me",
+    response_model=list[PhotoConfirmation],
+)
+async def patch_face_cluster_me(
+    session: DBSessionDep,
+    user: Annotated[User, Depends(get_current_active_user)],
+    cluster_id: int,
+):
+    faces = await FaceClusterStorage.get_cluster_faces(session, user.id, cluster_id)
+    if not faces:
+        raise HTTPException(status_code=404, detail="cluster not found")
+    photo_ids = list(dict.fromkeys(face.photo_id for face in faces))
+    return await confirm_user_photos(session, user, photo_ids)
+
+
 @router.get("/{photo_id}", response_model=Photo)
 async def get_photo_by_id(
     session: DBSessionDep,
     photo_id: int,
+    conditional: ConditionalDep,
 ):
+    # the version is bumped when users are linked, checked before loading them
+    if conditional.requested:
+        version = await PhotoStorage.get_photo_version(session, photo_id)
+        if version and (not_modified := conditional.check(make_etag(tuple(version)))):
+            return not_modified
     users_on_photo = await PhotoStorage.get_users_from_photo(session, photo_id)
+    if users_on_photo is not None:
+        conditional.check(make_etag(PhotoStorage.photo_version(users_on_photo)))
     return users_on_photo
 
 
+@router.get("/{photo_id}/file", response_class=FileResponse)
+async def get_photo_file(
+    session: DBSessionDep,
+    user: Annotated[User, Depends(get_current_active_user)],
+    photo_id: int,
+    conditional: ConditionalDep,
+):
+    photo = await PhotoStorage.get_photo(session, photo_id)
+    if photo is None or photo.file is None:
+        raise HTTPException(status_code=404, detail="photo not found")
+    # the uploader and the people tagged on the photo may see it
+    if (
+        photo.uploaded_by_id != user.id
+        and user.id not in await PhotoStorage.get_photo_user_ids(session, photo.id)
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You do not have permission to see this photo",
+        )
+    if not_modified := conditional.check(make_etag(file_key(photo)), IMMUTABLE):
+        return not_modified
+    return FileResponse(photo.file.path, headers=conditional.headers)
+
+
+@router.get("/{photo_id}/processing", response_model=PhotoProcessing)
+async def get_photo_processing(
+    session: DBSessionDep,
+    user: Annotated[User, Depends(get_current_active_user)],
+    photo_id: int,
+):
+    photo = await PhotoStorage.get_photo(session, photo_id)
+    if photo is None:
+        raise HTTPException(status_code=404, detail="photo not found")
+    if photo.uploaded_by_id != user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You do not have permission to see this photo",
+        )
+    return photo
+
+
 @router.delete("/{photo_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_photo_by_id(
     photo_id: int,
@@ -61,12 +273,15 @@ async def delete_photo_by_id(
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
         )
-    if not photo.uploaded_by == user:
+    if photo.uploaded_by_id != user.id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You do not have permission to delete this photo",
         )
+    faces = await FaceEmbeddingStorage.get_photo_faces(session, photo.id)
     await PhotoStorage.delete_photo(session, photo)
+    face_prototypes.discard(user.id)
+    await unindex_faces([face.id for face in faces])
 
 
 @router.patch("/{photo_id}/set-album")
@@ -97,21 +312,111 @@ async def patch_photo_me(
     photo = await PhotoStorage.get_photo(session, photo_id)
     if photo is None:
         raise HTTPException(status_code=404, detail="photo not found")
-    if photo.uploaded_by != user:
+    if photo.uploaded_by_id != user.id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You do not have permission to set up user on this photo this photo",
         )
-    if not await is_one_person_on_photo(photo):
+    analysis = await get_photo_analysis(session, photo)
+    if not await is_one_person_on_photo(analysis):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="On photo have to one person",
         )
-    single_owner_photos = await PhotoStorage.get_single_owner_photos(session, user)
-    if single_owner_photos:
-        if not await is_person_same(single_owner_photos, photo):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"The person on this photo not the user: {user.email}",
-            )
-    return await PhotoStorage.set_on_photo_only_owner(session, photo)
+    person = await get_user_prototype(session, user)
+    if not await is_person_same(person, analysis):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"The person on this photo not the user: {user.email}",
+        )
+    photo = await PhotoStorage.set_on_photo_only_owner(session, photo)
+    face_prototypes.add(user.id, analysis.encodings[0])
+    await index_faces(
+        user.id, await FaceEmbeddingStorage.get_photo_faces(session, photo.id)
+    )
+    return photo
+
+
+@router.patch("/set-it-is-me", response_model=list[PhotoConfirmation])
+async def patch_photos_me(
+    session: DBSessionDep,
+    user: Annotated[User, Depends(get_current_active_user)],
+    photo_ids: Annotated[list[int], Body()],
+):
+    return await confirm_user_photos(session, user, list(dict.fromkeys(photo_ids)))
+
+
+@router.post("/identify", response_model=list[PhotoIdentification])
+async def identify_users_on_photos(
+    session: DBSessionDep,
+    user: Annotated[User, Depends(get_current_active_user)],
+    photo_ids: Annotated[list[int], Body()],
+    top_k: int = 5,
+):
+    photos = await PhotoStorage.get_user_photos_by_ids(session, user, photo_ids)
+    return [await identify_photo(session, photo, top_k) for photo in photos]
+
+
+@router.post("/{photo_id}/identify", response_model=PhotoIdentification)
+async def identify_users_on_photo(
+    session: DBSessionDep,
+    user: Annotated[User, Depends(get_current_active_user)],
+    photo_id: int,
+    top_k: int = 5,
+):
+    photo = await PhotoStorage.get_photo(session, photo_id)
+    if photo is None:
+        raise HTTPException(status_code=404, detail="photo not found")
+    if photo.uploaded_by_id != user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You do not have permission to identify people on this photo",
+        )
+    return await identify_photo(session, photo, top_k)
+
+
+@router.get("/{photo_id}/tags", response_model=list[FaceTag])
+async def get_photo_tags(
+    session: DBSessionDep,
+    user: Annotated[User, Depends(get_current_active_user)],
+    photo_id: int,
+):
+    photo = await PhotoStorage.get_photo(session, photo_id)
+    if photo is None:
+        raise HTTPException(status_code=404, detail="photo not found")
+    if photo.uploaded_by_id != user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You do not have permission to see this photo",
+        )
+    return await photo_face_tags(session, photo.id)
+
+
+@router.patch("/{photo_id}/tags", response_model=list[FaceTag])
+async def accept_photo_tags(
+    session: DBSessionDep,
+    user: Annotated[User, Depends(get_current_active_user)],
+    photo_id: int,
+    face_ids: Annotated[list[int], Body()],
+):
+    photo = await PhotoStorage.get_photo(session, photo_id)
+    if photo is None:
+        raise HTTPException(status_code=404, detail="photo not found")
+    if photo.uploaded_by_id != user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You do not have permission to tag people on this photo",
+        )
+    # links the users proposed by the auto-tag stage for the given faces
+    faces = await FaceEmbeddingStorage.get_photo_faces(session, photo.id)
+    await link_users_to_photo(
+        session,
+        photo,
+        faces,
+        [
+            face.suggested_user_id
+            for face in faces
+            if face.id in face_ids and face.suggested_user_id is not None
+        ],
+    )
+    return await photo_face_tags(session, photo.id)
@@ -1,8 +1,10 @@
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 
+from app.api import serialization
 from app.api.deps import DBSessionDep, get_current_active_user
+from app.api.pagination import PageDep
 from app.db.crud import UserStorage as US
 from app.db.schemas import User, UserCreate
 
@@ -27,5 +29,9 @@ async def create_user_by_email(session: DBSessionDep, user_in: UserCreate):
 
 
 @router.get("/", response_model=list[User])
-async def get_all_users(session: DBSessionDep, offset: int = 0, limit: int = 100):
-    return await US.get_users(session, offset, limit)
+async def get_all_users(session: DBSessionDep, page: PageDep, response: Response):
+    rows = await US.get_user_rows(session, page.offset, page.limit, page.after_id)
+    page.respond(response, rows)
+    return serialization.FastJSONResponse(
+        serialization.users(rows), headers=dict(response.headers)
+    )
@@ -0,0 +1,86 @@
+import json
+from collections import defaultdict
+from typing import Any, Sequence
+
+from fastapi.responses import JSONResponse
+
+from app.db.database import storage
+
+try:
+    import orjson
+except ImportError:  # the stdlib encoder below gives the same output
+    orjson = None
+
+
+# List reads skip response_model validation and jsonable_encoder: the rows
+# come from column-selected queries and are turned into the dicts the
+# schemas in app.db.schemas would produce, with the same keys in the same
+# order, then rendered in one call.
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content)
+        return json.dumps(
+            content, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        ).encode("utf-8")
+
+
+def group_by(rows: Sequence, key: str) -> dict[int, list]:
+    grouped = defaultdict(list)
+    for row in rows:
+        grouped[getattr(row, key)].append(row)
+    return grouped
+
+
+def users(rows: Sequence) -> list[dict]:
+    # schemas.User
+    return [
+        {
+            "email": row.email,
+            "id": row.id,
+            "full_name": None,
+            "is_active": row.is_active,
+        }
+        for row in rows
+    ]
+
+
+def photos(rows: Sequence, user_rows: Sequence) -> list[dict]:
+    # schemas.Photo with schemas.UserForPhoto, user_rows carry photo_id
+    return _photos(rows, group_by(user_rows, "photo_id"))
+
+
+def _photos(rows: Sequence, users_by_photo: dict[int, list]) -> list[dict]:
+    return [
+        {
+            "title": row.title,
+            "description": row.description,
+            "id": row.id,
+            # rows carry the storage key, schemas.Photo renders the path
+            "file": storage.get_path(row.file) if row.file is not None else None,
+            "album_id": row.album_id,
+            "uploaded_by_id": row.uploaded_by_id,
+            "users": [
+                {"email": user.email, "id": user.id, "is_active": user.is_active}
+                for user in users_by_photo[row.id]
+            ],
+        }
+        for row in rows
+    ]
+
+
+def albums(rows: Sequence, photo_rows: Sequence, user_rows: Sequence) -> list[dict]:
+    # schemas.Album
+    photos_by_album = group_by(photo_rows, "album_id")
+    users_by_photo = group_by(user_rows, "photo_id")
+    return [
+        {
+            "title": row.title,
+            "description": row.description,
+            "id": row.id,
+            "is_display": row.is_display,
+            "owner_id": row.owner_id,
+            "photos": _photos(photos_by_album[row.id], users_by_photo),
+        }
+        for row in rows
+    ]
@@ -0,0 +1,96 @@
+"""Detection latency and face recall for several FACE_DETECTION_MAX_SIDE values.
+
+Faces found on the full resolution image are the ground truth, recall is the
+share of them matched (IoU >= 0.5) by the faces found on the downscaled copy.
+Synthetic images carry no faces and only measure latency, pass real photos
+with --samples to measure recall.
+
+    python -m app.benchmarks.detection_resolution --samples ~/faces
+"""
+
+import argparse
+import json
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import face_recognition
+
+from app.benchmarks.images import find_samples, parse_resolution, write_synthetic_images
+from app.face_id.utils import load_image, remap_locations
+
+
+def iou(a: tuple[int, int, int, int], b: tuple[int, int, int, int]) -> float:
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    intersection = max(0, right - left) * max(0, bottom - top)
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    return intersection / (area_a + area_b - intersection or 1)
+
+
+def detect(path: Path, max_side: int) -> tuple[list, float]:
+    start = time.perf_counter()
+    img, scale = load_image(str(path), max_side)
+    locations = face_recognition.face_locations(img)
+    elapsed = time.perf_counter() - start
+    return [tuple(round(v * scale) for v in box) for box in locations], elapsed
+
+
+def run(images: list[Path], sizes: list[int], repeat: int) -> list[dict]:
+    results = []
+    for path in images:
+        truth, _ = detect(path, 0)
+        for max_side in sizes:
+            timings, found = [], []
+            for _ in range(repeat):
+                found, elapsed = detect(path, max_side)
+                timings.append(elapsed)
+            matched = sum(any(iou(t, f) >= 0.5 for f in found) for t in truth)
+            results.append(
+                {
+                    "image": path.name,
+                    "max_side": max_side,
+                    "median_ms": statistics.median(timings) * 1000,
+                    "faces_full": len(truth),
+                    "faces_found": len(found),
+                    "recall": matched / len(truth) if truth else None,
+                }
+            )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[0, 640, 1024, 1600])
+    parser.add_argument(
+        "--resolutions",
+        type=parse_resolution,
+        nargs="*",
+        default=[(1920, 1080), (4032, 3024)],
+        help="synthetic images, WIDTHxHEIGHT",
+    )
+    parser.add_argument("--samples", type=Path, help="directory with real photos")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", type=Path, help="write raw results to a file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        images = write_synthetic_images(Path(tmp), args.resolutions)
+        images += find_samples(args.samples)
+        results = run(images, args.sizes, args.repeat)
+
+    print(f"{'image':40} {'max_side':>8} {'median ms':>10} {'faces':>7} {'recall':>7}")
+    for row in results:
+        recall = "-" if row["recall"] is None else f"{row['recall']:.2f}"
+        print(
+            f"{row['image'][:40]:40} {row['max_side']:>8} {row['median_ms']:>10.1f}"
+            f" {row['faces_found']:>3}/{row['faces_full']:<3} {recall:>7}"
+        )
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Latency percentiles and throughput of the face_recognition calls used by app.face_id.
+
+Synthetic images are generated deterministically and carry no faces, so on
+them face_encodings runs on a fixed centred box and the "it is me" path stops
+after the face count check. Pass real photos with --samples to measure the
+full path.
+
+    python -m app.benchmarks.face_pipeline --samples ~/faces --json before.json
+    python -m app.benchmarks.face_pipeline --samples ~/faces --compare before.json
+"""
+
+import argparse
+import asyncio
+import tempfile
+from pathlib import Path
+
+import face_recognition
+import numpy as np
+
+from app.benchmarks.images import find_samples, parse_resolution, write_synthetic_images
+from app.benchmarks.stats import compare, measure, print_table, write_report
+from app.core.config import settings
+from app.face_id.prototypes import ENCODING_SIZE, UserPrototype
+from app.face_id.utils import (
+    analyze_photo,
+    is_one_person_on_photo,
+    is_person_same,
+    load_image,
+)
+
+KEY = ("benchmark", "image", "size")
+
+
+def bench_image(
+    path: Path, prototype: UserPrototype, repeat: int, loop: asyncio.AbstractEventLoop
+) -> list[dict]:
+    full_image = face_recognition.load_image_file(str(path))
+    detection_image, _ = load_image(str(path), settings.FACE_DETECTION_MAX_SIDE)
+    height, width = full_image.shape[:2]
+    locations = face_recognition.face_locations(detection_image)
+    if not locations:
+        side = min(height, width) // 3
+        top, left = (height - side) // 2, (width - side) // 2
+        locations = [(top, left + side, top + side, left)]
+
+    async def it_is_me():
+        analysis = analyze_photo(str(path))
+        if await is_one_person_on_photo(analysis):
+            await is_person_same(prototype, analysis)
+
+    benchmarks = {
+        "load_image_file": lambda: face_recognition.load_image_file(str(path)),
+        "load_image": lambda: load_image(str(path), settings.FACE_DETECTION_MAX_SIDE),
+        "face_locations": lambda: face_recognition.face_locations(detection_image),
+        "face_encodings": lambda: face_recognition.face_encodings(
+            full_image, locations
+        ),
+        "analyze_photo": lambda: analyze_photo(str(path)),
+        "is_one_person_on_photo": lambda: loop.run_until_complete(
+            is_one_person_on_photo(analyze_photo(str(path)))
+        ),
+        "is_person_same": lambda: loop.run_until_complete(it_is_me()),
+    }
+    return [
+        {
+            "benchmark": name,
+            "image": path.name,
+            "size": f"{width}x{height}",
+            **measure(fn, repeat),
+        }
+        for name, fn in benchmarks.items()
+    ]
+
+
+def bench_compare(sizes: list[int], repeat: int) -> list[dict]:
+    rng = np.random.default_rng(0)
+    candidate = rng.normal(0, 0.1, ENCODING_SIZE)
+    results = []
+    for size in sizes:
+        known = rng.normal(0, 0.1, (size, ENCODING_SIZE))
+        prototype = UserPrototype(known)
+        benchmarks = {
+            "compare_faces": lambda: face_recognition.compare_faces(
+                list(known), candidate, settings.FACE_TOLERANCE
+            ),
+            "UserPrototype.verify": lambda: prototype.verify(
+                candidate, settings.FACE_TOLERANCE
+            ),
+        }
+        results += [
+            {
+                "benchmark": name,
+                "image": "-",
+                "size": size,
+                **measure(fn, repeat * 10, operations=size),
+            }
+            for name, fn in benchmarks.items()
+        ]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--resolutions",
+        type=parse_resolution,
+        nargs="*",
+        default=[(640, 480), (1920, 1080), (4032, 3024)],
+        help="synthetic images, WIDTHxHEIGHT",
+    )
+    parser.add_argument("--samples", type=Path, help="directory with real photos")
+    parser.add_argument(
+        "--known-faces",
+        type=int,
+        nargs="+",
+        default=[1, 10, 100, 1000],
+        help="reference set sizes for compare_faces",
+    )
+    parser.add_argument("--references", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", type=Path, help="write the report to a file")
+    parser.add_argument("--compare", type=Path, help="report written by --json")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    prototype = UserPrototype(rng.normal(0, 0.1, (args.references, ENCODING_SIZE)))
+    loop = asyncio.new_event_loop()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        images = write_synthetic_images(Path(tmp), args.resolutions)
+        for path in images + find_samples(args.samples):
+            results += bench_image(path, prototype, args.repeat, loop)
+    loop.close()
+    results += bench_compare(args.known_faces, args.repeat)
+
+    print_table(results, list(KEY))
+    if args.compare:
+        print()
+        print("\n".join(compare(results, args.compare, KEY)))
+    if args.json:
+        write_report(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import io
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+SAMPLE_SUFFIXES = {".jpg", ".jpeg", ".png"}
+
+
+def synthetic_image(width: int, height: int, seed: int = 0) -> Image.Image:
+    # smooth gradients plus random ellipses, deterministic for a given seed,
+    # so JPEG sizes and decode costs resemble a photo more than plain noise
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    channels = [
+        127 + 127 * np.sin(x / rng.uniform(50, 400) + y / rng.uniform(50, 400))
+        for _ in range(3)
+    ]
+    image = Image.fromarray(np.dstack(channels).astype(np.uint8))
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x0, y0 = rng.integers(0, width), rng.integers(0, height)
+        size = rng.integers(min(width, height) // 40, min(width, height) // 5)
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        draw.ellipse((x0, y0, x0 + size, y0 + size), fill=color)
+    return image
+
+
+def write_synthetic_images(
+    directory: Path, resolutions: list[tuple[int, int]], seed: int = 0
+) -> list[Path]:
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for width, height in resolutions:
+        path = directory / f"synthetic_{width}x{height}_{seed}.jpg"
+        if not path.exists():
+            synthetic_image(width, height, seed).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def find_samples(directory: Path | None) -> list[Path]:
+    if directory is None:
+        return []
+    return sorted(
+        path for path in directory.iterdir() if path.suffix.lower() in SAMPLE_SUFFIXES
+    )
+
+
+def encode_jpeg(image: Image.Image, quality: int = 90) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def parse_resolution(value: str) -> tuple[int, int]:
+    width, height = value.lower().split("x")
+    return int(width), int(height)
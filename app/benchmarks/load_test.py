@@ -0,0 +1,304 @@
+"""Mixed API workload against the app running in-process, no external services.
+
+The app is served through httpx's ASGI transport with the lifespan running,
+so the face engine and the ingestion pipeline are live. The database is a
+throwaway SQLite file unless --database-url points somewhere else, its
+tables are dropped and recreated.
+
+    python -m app.benchmarks.load_test --users 50 --photos-per-user 100 \\
+        --concurrency 16 --requests 2000 --mix list=6,albums=2,login=1,upload=1,me=1
+"""
+
+import os
+import shutil
+import tempfile
+
+# uploads and the embedding store go to a throwaway directory, the storage
+# singletons read it from the settings when they are imported below. Face
+# engine workers import this module again and inherit the parent's directory.
+WORKDIR = None
+if "PHOTO_DIR" not in os.environ:
+    WORKDIR = tempfile.mkdtemp(prefix="load_test-")
+    os.environ["PHOTO_DIR"] = WORKDIR
+    os.environ.setdefault("EMBEDDING_DIR", os.path.join(WORKDIR, "embeddings"))
+
+# the app settings are required at import time, none of them is used here
+for name, value in {
+    "SECRET_KEY": "load-test",
+    "ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "60",
+    "POSTGRESQL_USERNAME": "postgres",
+    "POSTGRESQL_PASSWORD": "load-test",
+    "POSTGRESQL_HOSTNAME": "localhost",
+    "POSTGRESQL_PORT": "5432",
+    "POSTGRESQL_DB_NAME": "load_test",
+}.items():
+    os.environ.setdefault(name, value)
+
+import argparse  # noqa: E402
+import asyncio  # noqa: E402
+import io  # noqa: E402
+import random  # noqa: E402
+import time  # noqa: E402
+from collections import Counter, defaultdict  # noqa: E402
+from pathlib import Path  # noqa: E402
+
+import httpx  # noqa: E402
+from fastapi import UploadFile  # noqa: E402
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine  # noqa: E402
+
+from app.benchmarks.images import encode_jpeg, find_samples, synthetic_image  # noqa
+from app.benchmarks.stats import summarize, write_report  # noqa: E402
+from app.core.config import settings  # noqa: E402
+from app.db import models  # noqa: E402
+from app.db.blob_collector import blob_collector  # noqa: E402
+from app.db.crud import PhotoStorage  # noqa: E402
+from app.db.database import Base, get_db_session  # noqa: E402
+from app.db.instrumentation import instrument_engine  # noqa: E402
+from app.face_id.clustering import face_clusterer  # noqa: E402
+from app.face_id.pipeline import ingestion_pipeline  # noqa: E402
+from app.main import app  # noqa: E402
+from app.utils import create_access_token, get_password_hash  # noqa: E402
+
+PASSWORD = "load-test-password"
+API = settings.API_V1_STR
+
+
+def parse_mix(value: str) -> dict[str, int]:
+    mix = {}
+    for part in value.split(","):
+        name, weight = part.split("=")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name}")
+        mix[name] = int(weight)
+    return mix
+
+
+class Seed:
+    def __init__(self):
+        self.users: list[models.User] = []
+        self.tokens: dict[int, str] = {}
+        self.unconfirmed: dict[int, list[int]] = defaultdict(list)
+        self.images: list[bytes] = []
+
+
+async def seed(session_factory, args: argparse.Namespace, images: list[bytes]) -> Seed:
+    data = Seed()
+    data.images = images
+    # one bcrypt hash for everybody, hashing is measured by the login scenario
+    hashed_password = await get_password_hash(PASSWORD)
+    async with session_factory() as session:
+        data.users = [
+            models.User(email=f"user{i}@load.test", hashed_password=hashed_password)
+            for i in range(args.users)
+        ]
+        session.add_all(data.users)
+        await session.commit()
+        for user in data.users:
+            albums = [
+                models.Album(title=f"album {i}", description="", owner_id=user.id)
+                for i in range(args.albums_per_user)
+            ]
+            keys = await PhotoStorage.store_files(
+                session,
+                [
+                    UploadFile(
+                        filename=f"seed_{user.id}_{i}.jpg",
+                        file=io.BytesIO(images[i % len(images)]),
+                    )
+                    for i in range(args.photos_per_user)
+                ],
+            )
+            photos = [
+                models.Photo(
+                    title=f"photo {i}",
+                    description="",
+                    uploaded_by_id=user.id,
+                    album=albums[i % len(albums)] if albums else None,
+                    file=key,
+                )
+                for i, key in enumerate(keys)
+            ]
+            session.add_all(albums + photos)
+            await session.commit()
+            # a share of the photos is already confirmed as the uploader
+            confirmed = photos[: int(len(photos) * args.confirmed_share)]
+            await PhotoStorage.link_users(
+                session, [(user.id, photo.id) for photo in confirmed]
+            )
+            await session.commit()
+            data.unconfirmed[user.id] = [photo.id for photo in photos[len(confirmed) :]]
+            data.tokens[user.id] = await create_access_token({"sub": user.email})
+    return data
+
+
+async def scenario_login(client: httpx.AsyncClient, data: Seed, user: models.User):
+    return await client.post(
+        f"{API}/token", data={"username": user.email, "password": PASSWORD}
+    )
+
+
+async def scenario_list(client: httpx.AsyncClient, data: Seed, user: models.User):
+    return await client.get(
+        f"{API}/photos/",
+        params={"limit": 50},
+        headers={"Authorization": f"Bearer {data.tokens[user.id]}"},
+    )
+
+
+async def scenario_albums(client: httpx.AsyncClient, data: Seed, user: models.User):
+    return await client.get(f"{API}/albums/", params={"user_id": user.id, "limit": 20})
+
+
+async def scenario_upload(client: httpx.AsyncClient, data: Seed, user: models.User):
+    return await client.post(
+        f"{API}/photos/",
+        data={"title": "upload", "description": "load test"},
+        files={"file": ("upload.jpg", random.choice(data.images))},
+        headers={"Authorization": f"Bearer {data.tokens[user.id]}"},
+    )
+
+
+async def scenario_me(client: httpx.AsyncClient, data: Seed, user: models.User):
+    photo_ids = data.unconfirmed[user.id]
+    photo_id = photo_ids.pop() if photo_ids else 0
+    return await client.patch(
+        f"{API}/photos/{photo_id}/set-it-is-me",
+        headers={"Authorization": f"Bearer {data.tokens[user.id]}"},
+    )
+
+
+SCENARIOS = {
+    "login": scenario_login,
+    "list": scenario_list,
+    "albums": scenario_albums,
+    "upload": scenario_upload,
+    "me": scenario_me,
+}
+
+
+async def drive(
+    client: httpx.AsyncClient, data: Seed, mix: dict[str, int], args
+) -> tuple[dict[str, list[float]], dict[str, Counter], float]:
+    rng = random.Random(0)
+    names, weights = list(mix), list(mix.values())
+    plan = rng.choices(names, weights, k=args.requests)
+    timings: dict[str, list[float]] = defaultdict(list)
+    statuses: dict[str, Counter] = defaultdict(Counter)
+    queue: asyncio.Queue[str] = asyncio.Queue()
+    for name in plan:
+        queue.put_nowait(name)
+
+    async def worker():
+        while not queue.empty():
+            name = queue.get_nowait()
+            user = rng.choice(data.users)
+            start = time.perf_counter()
+            try:
+                response = await SCENARIOS[name](client, data, user)
+                status = str(response.status_code)
+            except Exception as e:
+                status = type(e).__name__
+            timings[name].append(time.perf_counter() - start)
+            statuses[name][status] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    return timings, statuses, time.perf_counter() - start
+
+
+async def run(args: argparse.Namespace) -> list[dict]:
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.database_url or f"sqlite+aiosqlite:///{tmp}/load_test.sqlite"
+        engine = create_async_engine(url)
+        instrument_engine(engine)
+        session_factory = async_sessionmaker(engine, expire_on_commit=False)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+        images = [path.read_bytes() for path in find_samples(args.samples)]
+        images = images or [
+            encode_jpeg(synthetic_image(*args.image_size, seed=seed))
+            for seed in range(4)
+        ]
+        data = await seed(session_factory, args, images)
+
+        async def get_session():
+            async with session_factory() as session:
+                yield session
+
+        app.dependency_overrides[get_db_session] = get_session
+        ingestion_pipeline.session_factory = session_factory
+        blob_collector.session_factory = session_factory
+        face_clusterer.session_factory = session_factory
+        transport = httpx.ASGITransport(app=app)
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://load-test", timeout=None
+            ) as client:
+                timings, statuses, elapsed = await drive(client, data, args.mix, args)
+        await engine.dispose()
+    if WORKDIR:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+    results = []
+    for name, values in timings.items():
+        results.append(
+            {
+                "scenario": name,
+                "statuses": dict(statuses[name]),
+                **summarize(values),
+                "rps": len(values) / elapsed,
+            }
+        )
+    results.append(
+        {
+            "scenario": "total",
+            "statuses": dict(sum(statuses.values(), Counter())),
+            **summarize([v for values in timings.values() for v in values]),
+            "rps": args.requests / elapsed,
+        }
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="SQLAlchemy async URL")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--albums-per-user", type=int, default=5)
+    parser.add_argument("--photos-per-user", type=int, default=50)
+    parser.add_argument("--confirmed-share", type=float, default=0.2)
+    parser.add_argument("--samples", type=Path, help="directory with real photos")
+    parser.add_argument(
+        "--image-size", type=int, nargs=2, default=[640, 480], metavar=("W", "H")
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default="list=6,albums=2,login=1,upload=1,me=1",
+        help="scenario weights, scenarios: " + ", ".join(SCENARIOS),
+    )
+    parser.add_argument("--json", type=Path, help="write the report to a file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    print(
+        f"{'scenario':10} {'requests':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+        f" {'req/s':>8}  statuses"
+    )
+    for row in results:
+        print(
+            f"{row['scenario']:10} {row['runs']:>8} {row['p50_ms']:>9.1f}"
+            f" {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['rps']:>8.1f}"
+            f"  {row['statuses']}"
+        )
+    if args.json:
+        write_report(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
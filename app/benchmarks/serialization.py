@@ -0,0 +1,190 @@
+"""List responses end to end, ORM objects through the response_model versus rows.
+
+Both paths read the same photos of one owner from a throwaway SQLite file,
+so row decoding is part of the measurement: "orm_response_model" loads
+Photo objects with their users (the file column goes through
+ContentImageType, which opens every image) and serializes them the way
+FastAPI does for a route with response_model (validation, jsonable_encoder,
+json.dumps). "rows" runs the queries of the photo list route and
+app.api.serialization on the column-selected rows (orjson when installed),
+"rows_stdlib_json" the same with the json fallback.
+
+    python -m app.benchmarks.serialization --rows 1000 10000 --json before.json
+    python -m app.benchmarks.serialization --compare before.json
+"""
+
+import os
+import shutil
+import tempfile
+
+# the photos are stored in a throwaway directory, the storage singleton reads
+# it from the settings when it is imported below
+WORKDIR = None
+if "PHOTO_DIR" not in os.environ:
+    WORKDIR = tempfile.mkdtemp(prefix="serialization-")
+    os.environ["PHOTO_DIR"] = WORKDIR
+
+import argparse  # noqa: E402
+import asyncio  # noqa: E402
+import io  # noqa: E402
+import json  # noqa: E402
+from pathlib import Path  # noqa: E402
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+from sqlalchemy import insert, select  # noqa: E402
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine  # noqa
+from sqlalchemy.orm import selectinload  # noqa: E402
+
+from app.api import serialization  # noqa: E402
+from app.benchmarks.images import encode_jpeg, synthetic_image  # noqa: E402
+from app.benchmarks.stats import compare, measure, print_table, write_report  # noqa
+from app.db import models, schemas  # noqa: E402
+from app.db.crud import PhotoStorage, paginate  # noqa: E402
+from app.db.database import Base, storage  # noqa: E402
+
+KEY = ("benchmark", "rows")
+
+
+async def seed(session_factory, size: int, users_per_photo: int) -> models.User:
+    # every photo points at the same stored image, reading it is still one
+    # Image.open per row on the ORM path
+    image = encode_jpeg(synthetic_image(640, 480, seed=0))
+    key = storage.store(io.BytesIO(image), "photo.jpg")
+    async with session_factory() as session:
+        people = [
+            models.User(email=f"user{i}@bench.test", hashed_password="")
+            for i in range(max(users_per_photo, 1))
+        ]
+        session.add_all(people)
+        await session.flush()
+        owner = people[0]
+        photo_ids = (
+            await session.scalars(
+                insert(models.Photo).returning(
+                    models.Photo.id, sort_by_parameter_order=True
+                ),
+                [
+                    {
+                        "title": f"photo {i}",
+                        "description": "a photo used by the serialization benchmark",
+                        "file": key,
+                        "uploaded_by_id": owner.id,
+                    }
+                    for i in range(size)
+                ],
+            )
+        ).all()
+        await PhotoStorage.link_users(
+            session,
+            [
+                (person.id, photo_id)
+                for photo_id in photo_ids
+                for person in people[:users_per_photo]
+            ],
+        )
+        await session.commit()
+    return owner
+
+
+def bench(
+    loop, session_factory, owner: models.User, size: int, users_per_photo: int, repeat
+) -> list[dict]:
+    field = create_response_field("response", list[schemas.Photo])
+
+    async def load_photos():
+        # what the photo list route did before it selected columns
+        async with session_factory() as session:
+            stmt = paginate(
+                select(models.Photo)
+                .where(models.Photo.uploaded_by_id == owner.id)
+                .options(selectinload(models.Photo.users)),
+                models.Photo.id,
+                0,
+                size,
+            )
+            photos = (await session.scalars(stmt)).all()
+            return await serialize_response(field=field, response_content=photos)
+
+    async def load_rows():
+        async with session_factory() as session:
+            rows = await PhotoStorage.get_user_photo_rows(session, owner, 0, size)
+            user_rows = await PhotoStorage.get_photos_user_rows(
+                session, [row.id for row in rows]
+            )
+            return serialization.photos(rows, user_rows)
+
+    def orm_response_model() -> bytes:
+        return JSONResponse(loop.run_until_complete(load_photos())).body
+
+    def rows() -> bytes:
+        return serialization.FastJSONResponse(loop.run_until_complete(load_rows())).body
+
+    def rows_stdlib_json() -> bytes:
+        encoder, serialization.orjson = serialization.orjson, None
+        try:
+            return rows()
+        finally:
+            serialization.orjson = encoder
+
+    # both paths have to produce the same document
+    assert json.loads(orm_response_model()) == json.loads(rows())
+    benchmarks = {
+        "orm_response_model": orm_response_model,
+        "rows": rows,
+        "rows_stdlib_json": rows_stdlib_json,
+    }
+    return [
+        {
+            "benchmark": name,
+            "rows": size,
+            "users_per_photo": users_per_photo,
+            **measure(fn, repeat, operations=size),
+        }
+        for name, fn in benchmarks.items()
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--users-per-photo", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", type=Path, help="write the report to a file")
+    parser.add_argument("--compare", type=Path, help="report written by --json")
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp}/serialization.sqlite")
+        session_factory = async_sessionmaker(engine, expire_on_commit=False)
+
+        async def create_tables():
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+
+        loop.run_until_complete(create_tables())
+        owner = loop.run_until_complete(
+            seed(session_factory, max(args.rows), args.users_per_photo)
+        )
+        for size in args.rows:
+            results += bench(
+                loop, session_factory, owner, size, args.users_per_photo, args.repeat
+            )
+        loop.run_until_complete(engine.dispose())
+    loop.close()
+    if WORKDIR:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+    print_table(results, list(KEY))
+    if args.compare:
+        print()
+        print("\n".join(compare(results, args.compare, KEY)))
+    if args.json:
+        write_report(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import json
+import os
+import platform
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+
+
+def summarize(timings: list[float], operations: int = 1) -> dict[str, float]:
+    # timings in seconds, operations counts items handled per timed call
+    values = np.asarray(timings) * 1000
+    total = float(np.sum(timings))
+    return {
+        "runs": len(timings),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "throughput_per_s": len(timings) * operations / total if total else 0.0,
+    }
+
+
+def measure(
+    fn: Callable[[], Any], repeat: int, warmup: int = 1, operations: int = 1
+) -> dict[str, float]:
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return summarize(timings, operations)
+
+
+def environment() -> dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+    }
+
+
+def write_report(path: Path, results: list[dict]):
+    path.write_text(
+        json.dumps({"environment": environment(), "results": results}, indent=2)
+    )
+
+
+def compare(results: list[dict], baseline: Path, key: tuple[str, ...]) -> list[str]:
+    # p50 change against a previous --json report, matched on the key fields
+    previous = {
+        tuple(row.get(field) for field in key): row
+        for row in json.loads(baseline.read_text())["results"]
+    }
+    lines = []
+    for row in results:
+        old = previous.get(tuple(row.get(field) for field in key))
+        if old is None or not old["p50_ms"]:
+            continue
+        change = row["p50_ms"] / old["p50_ms"] - 1
+        name = " ".join(str(row.get(field)) for field in key)
+        lines.append(
+            f"{name:60} {old['p50_ms']:>9.2f} -> {row['p50_ms']:>9.2f} ms {change:+7.1%}"
+        )
+    return lines
+
+
+def print_table(results: list[dict], columns: list[str]):
+    first, *rest = columns
+    print(
+        " ".join([f"{first:32}"] + [f"{column:>24}" for column in rest])
+        + f" {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ops/s':>9}"
+    )
+    for row in results:
+        cells = [f"{str(row.get(first))[:32]:32}"]
+        cells += [f"{str(row.get(column))[:24]:>24}" for column in rest]
+        print(
+            " ".join(cells)
+            + f" {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} {row['p99_ms']:>9.2f}"
+            f" {row['throughput_per_s']:>9.1f}"
+        )
@@ -19,24 +19,87 @@ class Settings(BaseSettings):
     base_dir: Path = Path(__file__).parent.parent
     # photo_dir: Path = Path(base_dir.parent, "tmp")
     TESTS_RUNNING: bool = os.getenv("TESTS_RUNNING", False)
+    # override the directories below, e.g. for the load test
+    PHOTO_DIR: Path | None = None
+    EMBEDDING_DIR: Path | None = None
 
     @computed_field
     @property
     def photo_dir(self) -> Path:
+        if self.PHOTO_DIR:
+            return self.PHOTO_DIR
         if self.TESTS_RUNNING:
             return Path(self.base_dir.parent, "tmp")
         return Path(self.base_dir.parent, "images")
 
+    @computed_field
+    @property
+    def embedding_dir(self) -> Path:
+        if self.EMBEDDING_DIR:
+            return self.EMBEDDING_DIR
+        if self.TESTS_RUNNING:
+            return Path(self.base_dir.parent, "tmp", "embeddings")
+        return Path(self.base_dir.parent, "embeddings")
+
     SECRET_KEY: str
     ALGORITHM: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int
     ENVIRONMENT: Literal["local", "staging", "production"] = "local"
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = os.cpu_count() or 1
+    USER_CACHE_TTL_SECONDS: float = 60
+    USER_CACHE_MAX_SIZE: int = 10_000
+    TOKEN_CACHE_MAX_SIZE: int = 10_000
+
+    FACE_MODEL_VERSION: str = "dlib_face_recognition_resnet_model_v1"
+    FACE_ENGINE_WORKERS: int = os.cpu_count() or 1
+    FACE_ENGINE_MAX_CONCURRENCY: int = 16
+    FACE_WARMUP: bool = False
+    FACE_DETECTION_MAX_SIDE: int = 1600
+    FACE_TOLERANCE: float = 0.6
+    FACE_CENTROID_FAST_PATH: bool = True
+    FACE_PROTOTYPE_CACHE_SIZE: int = 1024
+    FACE_PROTOTYPE_TTL_SECONDS: float = 300
+    FACE_INDEX_NLIST: int = 0
+    FACE_INDEX_NPROBE: int = 8
+    FACE_INDEX_MIN_TRAIN_SIZE: int = 1024
+    FACE_EMBEDDING_STORE_ENABLED: bool = True
+    # share of deleted rows that triggers a compaction
+    FACE_EMBEDDING_COMPACT_RATIO: float = 0.25
+    FACE_CLUSTER_INTERVAL_SECONDS: float = 300
+    FACE_CLUSTER_CHUNK_SIZE: int = 512
+    # tighter than FACE_TOLERANCE, clusters grow by chaining close faces
+    FACE_CLUSTER_TOLERANCE: float = 0.5
+    FACE_CLUSTER_MIN_SIZE: int = 2
+    # after upload: off, propose (stored on the faces) or write user_to_photo
+    AUTO_TAG_MODE: Literal["off", "propose", "write"] = "off"
+    # distance to the nearest reference face, stricter than FACE_TOLERANCE
+    AUTO_TAG_TOLERANCE: float = 0.45
+    AUTO_TAG_TOP_K: int = 3
+    INGESTION_WORKERS: int = 4
+    INGESTION_QUEUE_SIZE: int = 1000
+    # a photo claimed longer ago is taken over by another worker
+    INGESTION_LEASE_SECONDS: float = 600
+    PHOTO_BATCH_MAX_FILES: int = 500
+    STORAGE_GC_INTERVAL_SECONDS: float = 3600
+    # how long an unreferenced file is kept before it is deleted
+    STORAGE_GC_GRACE_SECONDS: float = 3600
 
     POSTGRESQL_USERNAME: str
     POSTGRESQL_PASSWORD: str
     POSTGRESQL_HOSTNAME: str
     POSTGRESQL_PORT: int
     POSTGRESQL_DB_NAME: str
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+    # seconds, -1 keeps connections forever
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    # -1 disables server-side prepared statements
+    DB_PREPARE_THRESHOLD: int = 5
+    METRICS_ENABLED: bool = True
+    SERVER_TIMING_ENABLED: bool = False
 
     @computed_field
     @property
@@ -0,0 +1,176 @@
+import bisect
+import threading
+from typing import Callable, Iterable
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in labels)
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+
+    def samples(self) -> Iterable[tuple[str, Labels, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(
+            f"{name}{_format_labels(labels)} {_format_value(value)}"
+            for name, labels, value in self.samples()
+        )
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        for labels, value in list(self._values.items()):
+            yield self.name, labels, value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    # a callback gauge reads its value at scrape time, e.g. from the pool
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], float] | None = None,
+    ):
+        super().__init__(name, documentation)
+        self.callback = callback
+        self._value = 0.0
+
+    def set(self, value: float):
+        self._value = value
+
+    def value(self) -> float:
+        return self.callback() if self.callback else self._value
+
+    def samples(self):
+        yield self.name, (), self.value()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+    default_buckets = (
+        0.001,
+        0.0025,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1,
+        2.5,
+        5,
+        10,
+    )
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Iterable[float] = default_buckets,
+    ):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # per label set: bucket counts, sum of observations
+        self._values: dict[Labels, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total = self._values.setdefault(
+                key, ([0] * len(self.buckets), [0.0])
+            )
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    def count(self, **labels: str) -> int:
+        counts, _ = self._values.get(tuple(sorted(labels.items())), ([0], [0.0]))
+        return sum(counts)
+
+    def samples(self):
+        for labels, (counts, total) in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield self.name + "_bucket", labels + (
+                    ("le", _format_value(bound)),
+                ), cumulative
+            yield self.name + "_sum", labels, total[0]
+            yield self.name + "_count", labels, cumulative
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        # several engines (app, tests, benchmarks) share the same metrics
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._register(Counter(name, documentation))
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], float] | None = None,
+    ) -> Gauge:
+        gauge = self._register(Gauge(name, documentation))
+        if callback is not None:
+            gauge.callback = callback
+        return gauge
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Iterable[float] = Histogram.default_buckets,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,78 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+stage_seconds = metrics.histogram(
+    "app_stage_seconds", "Time spent in a request stage (decode, detect, db, ...)"
+)
+request_seconds = metrics.histogram(
+    "http_request_seconds", "Request latency by route template and status"
+)
+
+# stage -> seconds of the current request, only set when Server-Timing is on
+request_timings: ContextVar[dict[str, float] | None] = ContextVar(
+    "request_timings", default=None
+)
+
+
+def record(stage: str, seconds: float):
+    stage_seconds.observe(seconds, stage=stage)
+    timings = request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def span(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def server_timing(timings: dict[str, float], total: float) -> bytes:
+    parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts).encode("latin-1")
+
+
+class TimingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        timings = {} if settings.SERVER_TIMING_ENABLED else None
+        token = request_timings.set(timings)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if timings is not None:
+                    header = server_timing(timings, time.perf_counter() - start)
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        (b"server-timing", header),
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_timings.reset(token)
+            # the route template keeps the label set bounded, unlike the raw path
+            route = scope.get("route")
+            request_seconds.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=str(status_code),
+            )
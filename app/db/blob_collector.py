@@ -0,0 +1,55 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from app.core.config import settings
+from app.db.crud import BlobStorage
+from app.db.database import SessionLocal, storage
+
+logger = logging.getLogger(__name__)
+
+
+class BlobCollector:
+    def __init__(self, interval: float, grace: float):
+        self.interval = interval
+        self.grace = grace
+        self.session_factory = SessionLocal
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def shutdown(self):
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    async def collect(self) -> int:
+        released_before = datetime.now(timezone.utc) - timedelta(seconds=self.grace)
+        async with self.session_factory() as session:
+            keys = await BlobStorage.collect_garbage(session, released_before)
+            # an upload of the same content waits on the deleted rows, it
+            # finds the file gone and writes it again
+            for key in keys:
+                await asyncio.to_thread(storage.delete, key)
+            await session.commit()
+        return len(keys)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                removed = await self.collect()
+                if removed:
+                    logger.info("Removed %s unreferenced photo files", removed)
+            except Exception:
+                logger.exception("Photo file collection failed")
+
+
+blob_collector = BlobCollector(
+    interval=settings.STORAGE_GC_INTERVAL_SECONDS,
+    grace=settings.STORAGE_GC_GRACE_SECONDS,
+)
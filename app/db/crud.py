@@ -1,11 +1,41 @@
+import asyncio
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
 from typing import Sequence, Type
 
-from sqlalchemy import func, select, update
+import numpy as np
+from fastapi import UploadFile
+from sqlalchemy import (
+    Row,
+    String,
+    bindparam,
+    delete,
+    func,
+    insert,
+    select,
+    tuple_,
+    type_coerce,
+    update,
+)
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import relationships, selectinload
 
+from app.core.config import settings
 from app.db import models, schemas
-from app.utils import get_password_hash, verify_password
+from app.db.database import storage
+from app.utils import get_password_hash, verify_and_update_password
+
+
+def paginate(stmt, id_column, offset: int, limit: int, after_id: int | None = None):
+    stmt = stmt.order_by(id_column).limit(limit)
+    if after_id is not None:
+        return stmt.where(id_column > after_id)
+    return stmt.offset(offset)
+
+
+def file_key(photo: models.Photo) -> str | None:
+    return photo.file.name if photo.file is not None else None
 
 
 async def add_db_entity(session: AsyncSession, db_entity: Type[models.Base]):
@@ -34,12 +64,19 @@ class UserStorage:
         return result.scalar()
 
     @staticmethod
-    async def get_users(
-        session: AsyncSession, offset: int, limit: int
-    ) -> Sequence[models.User]:
-        stmt = select(models.User).offset(offset).limit(limit)
+    async def get_user_rows(
+        session: AsyncSession, offset: int, limit: int, after_id: int | None = None
+    ) -> Sequence[Row[tuple[int, str, bool]]]:
+        # list reads select columns only, see app.api.serialization
+        stmt = paginate(
+            select(models.User.id, models.User.email, models.User.is_active),
+            models.User.id,
+            offset,
+            limit,
+            after_id,
+        )
         result = await session.execute(stmt)
-        return result.scalars().all()
+        return result.all()
 
     @staticmethod
     async def create_user(session: AsyncSession, user: schemas.UserCreate):
@@ -53,11 +90,19 @@ class UserStorage:
     @staticmethod
     async def authenticate_user(session: AsyncSession, email: str, password: str):
         user = await UserStorage.get_user_by_email(session, email)
-        return (
-            user
-            if user and await verify_password(password, user.hashed_password)
-            else False
+        if not user:
+            return False
+        verified, new_hash = await verify_and_update_password(
+            password, user.hashed_password
         )
+        if not verified:
+            return False
+        # the hash was made with outdated settings (e.g. lower BCRYPT_ROUNDS)
+        if new_hash:
+            user.hashed_password = new_hash
+            session.add(user)
+            await session.commit()
+        return user
 
 
 # ================================= Photo ============================================
@@ -76,12 +121,141 @@ class PhotoStorage:
         photo: schemas.PhotoCreate,
         uploaded_by: schemas.User,
     ):
-        db_photo = models.Photo(**photo.dict(), uploaded_by_id=uploaded_by.id)
+        [key] = await PhotoStorage.store_files(session, [photo.file])
+        db_photo = models.Photo(
+            **photo.dict(exclude={"file"}), file=key, uploaded_by_id=uploaded_by.id
+        )
         session.add(db_photo)
-        await session.commit()
+        await session.flush()
         await session.refresh(db_photo)
+        await session.commit()
         return db_photo
 
+    @staticmethod
+    async def create_photos(
+        session: AsyncSession,
+        photos: Sequence[schemas.PhotoCreate],
+        uploaded_by: schemas.User,
+    ) -> Sequence[models.Photo]:
+        if not photos:
+            return []
+        # one INSERT ... RETURNING for the whole batch, rows come back in order
+        stmt = insert(models.Photo).returning(
+            models.Photo, sort_by_parameter_order=True
+        )
+        keys = await PhotoStorage.store_files(session, [photo.file for photo in photos])
+        result = await session.scalars(
+            stmt,
+            [
+                {
+                    **photo.dict(exclude={"file"}),
+                    "file": key,
+                    "uploaded_by_id": uploaded_by.id,
+                }
+                for photo, key in zip(photos, keys)
+            ],
+        )
+        db_photos = result.all()
+        await session.commit()
+        return db_photos
+
+    @staticmethod
+    async def store_files(
+        session: AsyncSession, uploads: Sequence[UploadFile]
+    ) -> list[str | None]:
+        # Stores the uploads and counts a ref for each, returns their keys.
+        # The refs are taken before a file is found to exist already. The
+        # collector removes a blob row and its file in one transaction, so an
+        # upload either keeps the file alive or waits until it is gone and
+        # writes it again.
+        staged = await asyncio.to_thread(PhotoStorage._stage_files, uploads)
+        keys = [item and item[0] for item in staged]
+        try:
+            await BlobStorage.add_refs(session, keys)
+        except BaseException:
+            PhotoStorage._discard_files(staged)
+            raise
+        await asyncio.to_thread(
+            lambda: [storage.place(*item) for item in staged if item]
+        )
+        return keys
+
+    @staticmethod
+    def _stage_files(uploads: Sequence[UploadFile]) -> list[tuple[str, str] | None]:
+        # image check, hash and copy of every upload, off the event loop
+        file_type = models.Photo.__table__.c.file.type
+        staged = []
+        try:
+            for upload in uploads:
+                staged.append(file_type.prepare(upload))
+        except BaseException:
+            PhotoStorage._discard_files(staged)
+            raise
+        return staged
+
+    @staticmethod
+    def _discard_files(staged: Sequence[tuple[str, str] | None]):
+        for item in staged:
+            if item:
+                storage.discard(item[1])
+
+    @staticmethod
+    async def set_processing_status(
+        session: AsyncSession,
+        photo: models.Photo,
+        processing_status: models.ProcessingStatus,
+        error: str | None = None,
+    ) -> models.Photo:
+        photo.processing_status = processing_status
+        photo.processing_error = error
+        session.add(photo)
+        await session.commit()
+        await session.refresh(photo)
+        return photo
+
+    @staticmethod
+    def claimable(expired_before: datetime):
+        # pending, or claimed by a worker that did not finish within its lease
+        status = models.Photo.processing_status
+        started_at = models.Photo.processing_started_at
+        return (status == models.ProcessingStatus.pending) | (
+            (status == models.ProcessingStatus.processing)
+            & (started_at.is_(None) | (started_at < expired_before))
+        )
+
+    @staticmethod
+    async def claim_photo(
+        session: AsyncSession, photo_id: int, expired_before: datetime
+    ) -> bool:
+        # one UPDATE decides between the workers of all processes
+        stmt = (
+            update(models.Photo)
+            .where(
+                (models.Photo.id == photo_id) & PhotoStorage.claimable(expired_before)
+            )
+            .values(
+                processing_status=models.ProcessingStatus.processing,
+                processing_started_at=datetime.now(timezone.utc),
+                version=models.Photo.version + 1,
+            )
+            .returning(models.Photo.id)
+        )
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.first() is not None
+
+    @staticmethod
+    async def get_unprocessed_photo_ids(
+        session: AsyncSession, expired_before: datetime
+    ) -> Sequence[int]:
+        stmt = (
+            select(models.Photo.id)
+            .where(PhotoStorage.claimable(expired_before))
+            .order_by(models.Photo.id)
+        )
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
     @staticmethod
     async def get_users_from_photo(session: AsyncSession, photo_id: int):
         stmt = (
@@ -92,30 +266,128 @@ class PhotoStorage:
         result = await session.execute(stmt)
         return result.scalar()
 
+    @staticmethod
+    async def get_photo_user_ids(session: AsyncSession, photo_id: int) -> set[int]:
+        stmt = select(models.user_to_photo.c.user_id).where(
+            models.user_to_photo.c.photo_id == photo_id
+        )
+        result = await session.execute(stmt)
+        return set(result.scalars().all())
+
     @staticmethod
     async def delete_photo(session: AsyncSession, photo: models.Photo):
+        key = file_key(photo)
+        await AlbumStorage.bump_versions(session, [photo.album_id])
+        await FaceClusterStorage.release_photo_faces(session, photo)
         await session.delete(photo)
+        await BlobStorage.release(session, [key])
         await session.commit()
 
     @staticmethod
-    async def get_user_photos(
-        session: AsyncSession, user: schemas.User, offset: int, limit: int
+    async def get_user_photos_by_ids(
+        session: AsyncSession, user: schemas.User, photo_ids: Sequence[int]
     ) -> Sequence[models.Photo]:
-        stmt = (
-            select(models.Photo)
-            .where(models.Photo.uploaded_by_id == user.id)
-            .offset(offset)
-            .limit(limit)
+        stmt = select(models.Photo).where(
+            (models.Photo.uploaded_by_id == user.id) & (models.Photo.id.in_(photo_ids))
         )
         result = await session.execute(stmt)
         return result.scalars().all()
 
+    @staticmethod
+    def photo_rows():
+        # the file column as its stored key, ContentImageType would open every
+        # image to read its size
+        return select(
+            models.Photo.id,
+            models.Photo.title,
+            models.Photo.description,
+            type_coerce(models.Photo.file, String).label("file"),
+            models.Photo.album_id,
+            models.Photo.uploaded_by_id,
+            models.Photo.version,
+        )
+
+    @staticmethod
+    async def get_user_photo_rows(
+        session: AsyncSession,
+        user: schemas.User,
+        offset: int,
+        limit: int,
+        after_id: int | None = None,
+    ) -> Sequence[Row]:
+        stmt = paginate(
+            PhotoStorage.photo_rows().where(models.Photo.uploaded_by_id == user.id),
+            models.Photo.id,
+            offset,
+            limit,
+            after_id,
+        )
+        result = await session.execute(stmt)
+        return result.all()
+
+    @staticmethod
+    async def get_photos_user_rows(
+        session: AsyncSession, photo_ids: Sequence[int]
+    ) -> Sequence[Row[tuple[int, int, str, bool]]]:
+        # (photo_id, id, email, is_active) of the users on the photos
+        stmt = (
+            select(
+                models.user_to_photo.c.photo_id,
+                models.User.id,
+                models.User.email,
+                models.User.is_active,
+            )
+            .join(models.User, models.User.id == models.user_to_photo.c.user_id)
+            .where(models.user_to_photo.c.photo_id.in_(photo_ids))
+            .order_by(models.user_to_photo.c.photo_id, models.User.id)
+        )
+        result = await session.execute(stmt)
+        return result.all()
+
+    @staticmethod
+    def photo_version(photo: models.Photo) -> tuple[int, int]:
+        # what get_photo_version and get_user_photo_versions return for a row
+        return photo.id, photo.version
+
+    @staticmethod
+    async def get_photo_version(
+        session: AsyncSession, photo_id: int
+    ) -> Row[tuple[int, int]] | None:
+        stmt = select(models.Photo.id, models.Photo.version).where(
+            models.Photo.id == photo_id
+        )
+        result = await session.execute(stmt)
+        return result.first()
+
+    @staticmethod
+    async def get_user_photo_versions(
+        session: AsyncSession,
+        user: schemas.User,
+        offset: int,
+        limit: int,
+        after_id: int | None = None,
+    ) -> Sequence[Row[tuple[int, int]]]:
+        # the same page as get_user_photo_rows, versions only
+        stmt = paginate(
+            select(models.Photo.id, models.Photo.version).where(
+                models.Photo.uploaded_by_id == user.id
+            ),
+            models.Photo.id,
+            offset,
+            limit,
+            after_id,
+        )
+        result = await session.execute(stmt)
+        return result.all()
+
     @staticmethod
     async def change_photo_album(
         session: AsyncSession,
         photo: models.Photo,
         album: models.Album,
     ) -> models.Photo:
+        # both albums change their membership
+        await AlbumStorage.bump_versions(session, [photo.album_id, album.id])
         photo.album = album
         session.add(photo)
         await session.commit()
@@ -126,44 +398,274 @@ class PhotoStorage:
     async def get_single_owner_photos(
         session: AsyncSession, user: schemas.User
     ) -> Sequence[models.Photo] | None:
-        subquery = (
-            select(models.user_to_photo.c.photo_id)
-            .group_by(models.user_to_photo.c.photo_id)
-            .having(func.count(models.user_to_photo.c.user_id) == 1)
-        )
-        query = select(models.Photo).where(
-            (models.Photo.uploaded_by == user) & (models.Photo.id.in_(subquery))
-        )
+        query = select(models.Photo).where(PhotoStorage.shows_only(user.id))
         result = await session.execute(query)
         return result.scalars().all()
 
     @staticmethod
-    async def set_on_photo_only_owner(session: AsyncSession, photo: models.Photo):
+    def shows_only(user_id: int):
+        # uploaded by the user and linked to nobody else; tags can link people
+        # other than the uploader, so the link itself has to be the user's
+        return (
+            (models.Photo.uploaded_by_id == user_id)
+            & (models.Photo.people_count == 1)
+            & (
+                select(models.user_to_photo.c.photo_id)
+                .where(
+                    (models.user_to_photo.c.photo_id == models.Photo.id)
+                    & (models.user_to_photo.c.user_id == user_id)
+                )
+                .exists()
+            )
+        )
+
+    @staticmethod
+    async def get_linked_photo_ids(
+        session: AsyncSession, user_id: int, photo_ids: Sequence[int]
+    ) -> set[int]:
+        stmt = select(models.user_to_photo.c.photo_id).where(
+            (models.user_to_photo.c.user_id == user_id)
+            & (models.user_to_photo.c.photo_id.in_(photo_ids))
+        )
+        result = await session.execute(stmt)
+        return set(result.scalars().all())
+
+    @staticmethod
+    async def link_users(session: AsyncSession, links: Sequence[tuple[int, int]]):
+        # (user_id, photo_id) pairs, people_count follows user_to_photo
+        if not links:
+            return
         await session.execute(
             models.user_to_photo.insert(),
-            [{"user_id": photo.uploaded_by_id, "photo_id": photo.id}],
+            [{"user_id": user_id, "photo_id": photo_id} for user_id, photo_id in links],
+        )
+        await PhotoStorage._add_people(session, links, 1)
+
+    @staticmethod
+    async def unlink_users(session: AsyncSession, links: Sequence[tuple[int, int]]):
+        if not links:
+            return
+        # only the links that existed are subtracted from people_count
+        result = await session.execute(
+            delete(models.user_to_photo)
+            .where(
+                tuple_(
+                    models.user_to_photo.c.user_id, models.user_to_photo.c.photo_id
+                ).in_(links)
+            )
+            .returning(models.user_to_photo.c.user_id, models.user_to_photo.c.photo_id)
+        )
+        await PhotoStorage._add_people(session, result.all(), -1)
+
+    @staticmethod
+    async def _add_people(
+        session: AsyncSession, links: Sequence[tuple[int, int]], sign: int
+    ):
+        photos = models.Photo.__table__
+        stmt = (
+            update(photos)
+            .where(photos.c.id == bindparam("photo"))
+            .values(
+                people_count=photos.c.people_count + bindparam("added"),
+                version=photos.c.version + 1,
+            )
+        )
+        added = Counter(photo_id for _, photo_id in links)
+        if not added:
+            return
+        await session.execute(
+            stmt,
+            [{"photo": photo_id, "added": sign * n} for photo_id, n in added.items()],
         )
+
+    @staticmethod
+    async def set_on_photo_only_owner(session: AsyncSession, photo: models.Photo):
+        await PhotoStorage.link_users(session, [(photo.uploaded_by_id, photo.id)])
         await session.commit()
         await session.refresh(photo)
         return photo
 
 
+# ================================= Blobs ============================================
+
+
+class BlobStorage:
+    @staticmethod
+    async def add_refs(session: AsyncSession, keys: Sequence[str | None]):
+        counts = Counter(key for key in keys if key)
+        if not counts:
+            return
+        dialect = session.get_bind().dialect.name
+        insert_ = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = insert_(models.Blob).values(
+            [
+                {
+                    "key": key,
+                    "refcount": count,
+                    "updated_at": datetime.now(timezone.utc),
+                }
+                for key, count in counts.items()
+            ]
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[models.Blob.key],
+            set_={
+                "refcount": models.Blob.refcount + stmt.excluded.refcount,
+                "updated_at": stmt.excluded.updated_at,
+            },
+        )
+        await session.execute(stmt)
+
+    @staticmethod
+    async def release(session: AsyncSession, keys: Sequence[str | None]):
+        counts = Counter(key for key in keys if key)
+        if not counts:
+            return
+        blobs = models.Blob.__table__
+        stmt = (
+            update(blobs)
+            .where(blobs.c.key == bindparam("blob_key"))
+            .values(
+                refcount=blobs.c.refcount - bindparam("released"),
+                updated_at=bindparam("released_at"),
+            )
+        )
+        released_at = datetime.now(timezone.utc)
+        await session.execute(
+            stmt,
+            [
+                {"blob_key": key, "released": count, "released_at": released_at}
+                for key, count in counts.items()
+            ],
+        )
+
+    @staticmethod
+    async def collect_garbage(
+        session: AsyncSession, released_before: datetime
+    ) -> Sequence[str]:
+        # unreferenced for a while, an upload of the same content in between
+        # would have brought the refcount back above zero. The deleted rows
+        # stay locked until the caller commits, it removes the files first.
+        stmt = (
+            delete(models.Blob)
+            .where(
+                (models.Blob.refcount <= 0) & (models.Blob.updated_at < released_before)
+            )
+            .returning(models.Blob.key)
+        )
+        result = await session.scalars(stmt)
+        return result.all()
+
+
 # ================================= Albums ============================================
 
 
 class AlbumStorage:
     @staticmethod
-    async def get_user_albums(
-        session: AsyncSession, user_id, offset: int, limit: int
-    ) -> Sequence[models.Album]:
+    def photos_with_users():
+        return selectinload(models.Album.photos).selectinload(models.Photo.users)
+
+    @staticmethod
+    async def get_user_album_rows(
+        session: AsyncSession,
+        user_id,
+        offset: int,
+        limit: int,
+        after_id: int | None = None,
+    ) -> Sequence[Row]:
+        stmt = paginate(
+            select(
+                models.Album.id,
+                models.Album.title,
+                models.Album.description,
+                models.Album.is_display,
+                models.Album.owner_id,
+                models.Album.version,
+            ).where(models.Album.owner_id == user_id),
+            models.Album.id,
+            offset,
+            limit,
+            after_id,
+        )
+        result = await session.execute(stmt)
+        return result.all()
+
+    @staticmethod
+    async def get_albums_photo_rows(
+        session: AsyncSession, album_ids: Sequence[int]
+    ) -> Sequence[Row]:
         stmt = (
-            select(models.Album)
-            .where(models.Album.owner_id == user_id)
-            .offset(offset)
-            .limit(limit)
+            PhotoStorage.photo_rows()
+            .where(models.Photo.album_id.in_(album_ids))
+            .order_by(models.Photo.id)
         )
         result = await session.execute(stmt)
-        return result.scalars().all()
+        return result.all()
+
+    @staticmethod
+    async def bump_versions(session: AsyncSession, album_ids: Sequence[int | None]):
+        # photos moving in or out of an album change its version, the sums
+        # below could add up to the same values for another set of photos
+        album_ids = {album_id for album_id in album_ids if album_id is not None}
+        if not album_ids:
+            return
+        await session.execute(
+            update(models.Album)
+            .where(models.Album.id.in_(album_ids))
+            .values(version=models.Album.version + 1)
+        )
+
+    @staticmethod
+    def album_version(album, photos: Sequence) -> tuple[int, int, int, int, int]:
+        # the row album_versions() returns, from loaded albums or rows
+        return (
+            album.id,
+            album.version,
+            len(photos),
+            sum(photo.id for photo in photos),
+            sum(photo.version for photo in photos),
+        )
+
+    @staticmethod
+    def album_versions():
+        # membership changes bump the album version, photo changes the sum
+        return (
+            select(
+                models.Album.id,
+                models.Album.version,
+                func.count(models.Photo.id),
+                func.coalesce(func.sum(models.Photo.id), 0),
+                func.coalesce(func.sum(models.Photo.version), 0),
+            )
+            .outerjoin(models.Photo, models.Photo.album_id == models.Album.id)
+            .group_by(models.Album.id)
+        )
+
+    @staticmethod
+    async def get_album_version(
+        session: AsyncSession, album_id: int
+    ) -> Row[tuple[int, int, int, int, int]] | None:
+        stmt = AlbumStorage.album_versions().where(models.Album.id == album_id)
+        result = await session.execute(stmt)
+        return result.first()
+
+    @staticmethod
+    async def get_user_album_versions(
+        session: AsyncSession,
+        user_id: int,
+        offset: int,
+        limit: int,
+        after_id: int | None = None,
+    ) -> Sequence[Row[tuple[int, int, int, int, int]]]:
+        stmt = paginate(
+            AlbumStorage.album_versions().where(models.Album.owner_id == user_id),
+            models.Album.id,
+            offset,
+            limit,
+            after_id,
+        )
+        result = await session.execute(stmt)
+        return result.all()
 
     @staticmethod
     async def create_album(
@@ -179,6 +681,18 @@ class AlbumStorage:
     async def get_album(session: AsyncSession, album_id: int) -> models.Album | None:
         return await session.get(models.Album, album_id)
 
+    @staticmethod
+    async def get_album_with_photos(
+        session: AsyncSession, album_id: int
+    ) -> models.Album | None:
+        stmt = (
+            select(models.Album)
+            .where(models.Album.id == album_id)
+            .options(AlbumStorage.photos_with_users())
+        )
+        result = await session.execute(stmt)
+        return result.scalar()
+
     @staticmethod
     async def delete_album(session: AsyncSession, album: models.Album):
         await session.delete(album)
@@ -190,10 +704,334 @@ class AlbumStorage:
     ) -> models.Album:
         query = (
             update(models.Album)
-            .values(**album_update.dict())
+            .values(**album_update.dict(), version=models.Album.version + 1)
             .where(models.Album.id == album.id)
         )
         await session.execute(query)
         await session.commit()
         await session.refresh(album)
         return album
+
+
+# ================================= Faces ============================================
+
+
+class FaceEmbeddingStorage:
+    @staticmethod
+    async def create_photo_faces(
+        session: AsyncSession,
+        photo: models.Photo,
+        faces: Sequence[tuple[Sequence[int], np.ndarray]],
+    ):
+        await FaceClusterStorage.release_photo_faces(session, photo)
+        await session.execute(
+            delete(models.FaceEmbedding).where(
+                models.FaceEmbedding.photo_id == photo.id
+            )
+        )
+        db_faces = [
+            models.FaceEmbedding(
+                photo_id=photo.id,
+                face_index=face_index,
+                top=top,
+                right=right,
+                bottom=bottom,
+                left=left,
+                encoding=np.asarray(encoding, dtype=np.float64).tobytes(),
+                model_version=settings.FACE_MODEL_VERSION,
+            )
+            for face_index, ((top, right, bottom, left), encoding) in enumerate(faces)
+        ]
+        session.add_all(db_faces)
+        photo.face_count = len(db_faces)
+        session.add(photo)
+        await session.commit()
+        await session.refresh(photo)
+
+    @staticmethod
+    async def get_photo_faces(
+        session: AsyncSession, photo_id: int
+    ) -> Sequence[models.FaceEmbedding]:
+        stmt = (
+            select(models.FaceEmbedding)
+            .where(
+                (models.FaceEmbedding.photo_id == photo_id)
+                & (models.FaceEmbedding.model_version == settings.FACE_MODEL_VERSION)
+            )
+            .order_by(models.FaceEmbedding.face_index)
+        )
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+    @staticmethod
+    async def get_photos_faces(
+        session: AsyncSession, photo_ids: Sequence[int]
+    ) -> Sequence[models.FaceEmbedding]:
+        stmt = (
+            select(models.FaceEmbedding)
+            .where(
+                (models.FaceEmbedding.photo_id.in_(photo_ids))
+                & (models.FaceEmbedding.model_version == settings.FACE_MODEL_VERSION)
+            )
+            .order_by(models.FaceEmbedding.photo_id, models.FaceEmbedding.face_index)
+        )
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+    @staticmethod
+    async def set_suggestions(
+        session: AsyncSession, suggestions: Sequence[tuple[int, int, float]]
+    ):
+        # (face_id, user_id, distance)
+        if not suggestions:
+            return
+        faces = models.FaceEmbedding.__table__
+        stmt = (
+            update(faces)
+            .where(faces.c.id == bindparam("face"))
+            .values(
+                suggested_user_id=bindparam("user"),
+                suggested_distance=bindparam("distance"),
+            )
+        )
+        await session.execute(
+            stmt,
+            [
+                {"face": face_id, "user": user_id, "distance": distance}
+                for face_id, user_id, distance in suggestions
+            ],
+        )
+
+    @staticmethod
+    async def get_single_owner_encodings(
+        session: AsyncSession, user: schemas.User
+    ) -> Sequence[Row[tuple[int, bytes | None]]]:
+        # photos not processed by the current model come back without encoding
+        stmt = (
+            select(models.Photo.id, models.FaceEmbedding.encoding)
+            .outerjoin(
+                models.FaceEmbedding,
+                (models.FaceEmbedding.photo_id == models.Photo.id)
+                & (models.FaceEmbedding.model_version == settings.FACE_MODEL_VERSION),
+            )
+            .where(PhotoStorage.shows_only(user.id))
+        )
+        result = await session.execute(stmt)
+        return result.all()
+
+    @staticmethod
+    async def get_confirmed_faces(
+        session: AsyncSession,
+    ) -> Sequence[Row[tuple[int, int, bytes]]]:
+        # faces of one-person photos linked to a user through user_to_photo
+        stmt = (
+            select(
+                models.FaceEmbedding.id,
+                models.user_to_photo.c.user_id,
+                models.FaceEmbedding.encoding,
+            )
+            .join(
+                models.user_to_photo,
+                models.user_to_photo.c.photo_id == models.FaceEmbedding.photo_id,
+            )
+            .join(models.Photo, models.Photo.id == models.FaceEmbedding.photo_id)
+            .where(
+                (models.Photo.face_count == 1)
+                & (models.FaceEmbedding.model_version == settings.FACE_MODEL_VERSION)
+            )
+        )
+        result = await session.execute(stmt)
+        return result.all()
+
+
+# ================================= Face clusters =====================================
+
+
+class FaceClusterStorage:
+    @staticmethod
+    def unconfirmed_faces(owner_id: int):
+        # faces on photos of the owner that nobody has confirmed yet
+        return (
+            select(models.FaceEmbedding)
+            .join(models.Photo, models.Photo.id == models.FaceEmbedding.photo_id)
+            .where(
+                (models.Photo.uploaded_by_id == owner_id)
+                & (models.Photo.people_count == 0)
+                & (models.FaceEmbedding.model_version == settings.FACE_MODEL_VERSION)
+            )
+        )
+
+    @staticmethod
+    async def get_owners_with_unclustered_faces(session: AsyncSession) -> Sequence[int]:
+        stmt = (
+            select(models.Photo.uploaded_by_id)
+            .join(
+                models.FaceEmbedding, models.FaceEmbedding.photo_id == models.Photo.id
+            )
+            .where(
+                (models.Photo.people_count == 0)
+                & models.FaceEmbedding.cluster_id.is_(None)
+                & (models.FaceEmbedding.model_version == settings.FACE_MODEL_VERSION)
+            )
+            .distinct()
+        )
+        result = await session.scalars(stmt)
+        return result.all()
+
+    @staticmethod
+    async def lock_owner(
+        session: AsyncSession, owner_id: int, wait: bool = False
+    ) -> bool:
+        # held until commit, another worker skips this library meanwhile
+        stmt = (
+            select(models.User.id)
+            .where(models.User.id == owner_id)
+            .with_for_update(skip_locked=not wait)
+        )
+        result = await session.execute(stmt)
+        return result.scalar() is not None
+
+    @staticmethod
+    async def release_photo_faces(session: AsyncSession, photo: models.Photo):
+        # Takes the faces of a photo out of their clusters before they are
+        # deleted, the running means drop their encodings again. Waits for a
+        # clustering run of the library, it holds the sizes it has read.
+        await FaceClusterStorage.lock_owner(session, photo.uploaded_by_id, wait=True)
+        stmt = select(
+            models.FaceEmbedding.cluster_id, models.FaceEmbedding.encoding
+        ).where(
+            (models.FaceEmbedding.photo_id == photo.id)
+            & models.FaceEmbedding.cluster_id.is_not(None)
+        )
+        removed = defaultdict(list)
+        for cluster_id, encoding in (await session.execute(stmt)).all():
+            removed[cluster_id].append(np.frombuffer(encoding, dtype=np.float64))
+        if not removed:
+            return
+        stmt = select(
+            models.FaceCluster.id, models.FaceCluster.size, models.FaceCluster.centroid
+        ).where(models.FaceCluster.id.in_(removed))
+        kept, centroids, sizes, emptied = [], [], [], []
+        for cluster_id, size, centroid in (await session.execute(stmt)).all():
+            encodings = removed[cluster_id]
+            if size <= len(encodings):
+                emptied.append(cluster_id)
+                continue
+            total = np.frombuffer(centroid, dtype=np.float64) * size
+            kept.append(cluster_id)
+            sizes.append(size - len(encodings))
+            centroids.append((total - np.sum(encodings, axis=0)) / sizes[-1])
+        await FaceClusterStorage.update_clusters(
+            session, kept, np.asarray(centroids), np.asarray(sizes)
+        )
+        if emptied:
+            await session.execute(
+                delete(models.FaceCluster).where(models.FaceCluster.id.in_(emptied))
+            )
+
+    @staticmethod
+    async def get_unclustered_faces(
+        session: AsyncSession, owner_id: int, limit: int
+    ) -> Sequence[Row[tuple[int, bytes]]]:
+        stmt = (
+            FaceClusterStorage.unconfirmed_faces(owner_id)
+            .with_only_columns(models.FaceEmbedding.id, models.FaceEmbedding.encoding)
+            .where(models.FaceEmbedding.cluster_id.is_(None))
+            .order_by(models.FaceEmbedding.id)
+            .limit(limit)
+        )
+        result = await session.execute(stmt)
+        return result.all()
+
+    @staticmethod
+    async def get_owner_clusters(
+        session: AsyncSession, owner_id: int
+    ) -> Sequence[models.FaceCluster]:
+        stmt = (
+            select(models.FaceCluster)
+            .where(models.FaceCluster.owner_id == owner_id)
+            .order_by(models.FaceCluster.id)
+        )
+        result = await session.scalars(stmt)
+        return result.all()
+
+    @staticmethod
+    async def create_clusters(
+        session: AsyncSession, owner_id: int, centroids: np.ndarray, sizes: np.ndarray
+    ) -> Sequence[int]:
+        if not len(centroids):
+            return []
+        stmt = insert(models.FaceCluster).returning(
+            models.FaceCluster.id, sort_by_parameter_order=True
+        )
+        result = await session.scalars(
+            stmt,
+            [
+                {
+                    "owner_id": owner_id,
+                    "size": int(size),
+                    "centroid": centroid.tobytes(),
+                }
+                for centroid, size in zip(centroids, sizes)
+            ],
+        )
+        return result.all()
+
+    @staticmethod
+    async def update_clusters(
+        session: AsyncSession,
+        cluster_ids: Sequence[int],
+        centroids: np.ndarray,
+        sizes: np.ndarray,
+    ):
+        if not len(cluster_ids):
+            return
+        clusters = models.FaceCluster.__table__
+        stmt = (
+            update(clusters)
+            .where(clusters.c.id == bindparam("cluster"))
+            .values(size=bindparam("new_size"), centroid=bindparam("new_centroid"))
+        )
+        await session.execute(
+            stmt,
+            [
+                {
+                    "cluster": cluster_id,
+                    "new_size": int(size),
+                    "new_centroid": centroid.tobytes(),
+                }
+                for cluster_id, centroid, size in zip(cluster_ids, centroids, sizes)
+            ],
+        )
+
+    @staticmethod
+    async def set_face_clusters(
+        session: AsyncSession, face_ids: Sequence[int], cluster_ids: Sequence[int]
+    ):
+        faces = models.FaceEmbedding.__table__
+        stmt = (
+            update(faces)
+            .where(faces.c.id == bindparam("face"))
+            .values(cluster_id=bindparam("cluster"))
+        )
+        await session.execute(
+            stmt,
+            [
+                {"face": face_id, "cluster": cluster_id}
+                for face_id, cluster_id in zip(face_ids, cluster_ids)
+            ],
+        )
+
+    @staticmethod
+    async def get_cluster_faces(
+        session: AsyncSession, owner_id: int, cluster_id: int | None = None
+    ) -> Sequence[models.FaceEmbedding]:
+        stmt = (
+            FaceClusterStorage.unconfirmed_faces(owner_id)
+            .where(models.FaceEmbedding.cluster_id.is_not(None))
+            .order_by(models.FaceEmbedding.cluster_id, models.FaceEmbedding.id)
+        )
+        if cluster_id is not None:
+            stmt = stmt.where(models.FaceEmbedding.cluster_id == cluster_id)
+        result = await session.scalars(stmt)
+        return result.all()
@@ -0,0 +1,81 @@
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app.core.metrics import metrics
+from app.core.timing import record
+
+pool_wait_seconds = metrics.histogram(
+    "db_pool_wait_seconds", "Time spent waiting for a pooled connection"
+)
+pool_timeouts = metrics.counter(
+    "db_pool_timeouts_total", "Connection requests that hit DB_POOL_TIMEOUT"
+)
+statement_seconds = metrics.histogram(
+    "db_statement_seconds", "Statement execution time by statement type"
+)
+statement_errors = metrics.counter(
+    "db_statement_errors_total", "Failed statements by statement type"
+)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        # includes opening a new connection when the pool may still grow
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except TimeoutError:
+            pool_timeouts.inc()
+            raise
+        finally:
+            pool_wait_seconds.observe(time.perf_counter() - start)
+
+
+def _operation(statement: str) -> str:
+    words = statement.split(None, 1)
+    return words[0].upper() if words else ""
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    statement_seconds.observe(elapsed, operation=_operation(statement))
+    record("db", elapsed)
+
+
+def _handle_error(context):
+    starts = context.connection.info.get("query_start") if context.connection else None
+    if starts:
+        starts.pop()
+    statement_errors.inc(operation=_operation(context.statement or ""))
+
+
+def instrument_engine(engine: AsyncEngine):
+    sync_engine = engine.sync_engine
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
+    pool = sync_engine.pool
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        metrics.gauge(
+            "db_pool_checked_out",
+            "Connections currently checked out of the pool",
+            callback=lambda: engine.sync_engine.pool.checkedout(),
+        )
+        metrics.gauge(
+            "db_pool_size",
+            "Connections kept open by the pool",
+            callback=lambda: engine.sync_engine.pool.size(),
+        )
+        metrics.gauge(
+            "db_pool_overflow",
+            "Connections opened above DB_POOL_SIZE",
+            callback=lambda: max(engine.sync_engine.pool.overflow(), 0),
+        )
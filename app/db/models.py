@@ -1,10 +1,25 @@
+import enum
+from datetime import datetime
 from typing import List
 
-from fastapi_storages.integrations.sqlalchemy import ImageType
-from sqlalchemy import Column, ForeignKey, Integer, Table
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+import numpy as np
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Enum,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+    Table,
+    event,
+    func,
+)
+from sqlalchemy.orm import Mapped, mapped_column, object_session, relationship
 
 from .database import Base, storage
+from .storage import ContentImageType
 
 user_to_photo = Table(
     "user_to_photo",
@@ -14,6 +29,13 @@ user_to_photo = Table(
 )
 
 
+class ProcessingStatus(str, enum.Enum):
+    pending = "pending"
+    processing = "processing"
+    done = "done"
+    failed = "failed"
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -36,12 +58,15 @@ class User(Base):
 
 class Album(Base):
     __tablename__ = "albums"
+    __table_args__ = (Index("ix_albums_owner_id_id", "owner_id", "id"),)
 
     id: Mapped[int] = mapped_column(primary_key=True)
     title: Mapped[str] = mapped_column(index=True)
     description: Mapped[str] = mapped_column()
     is_display: Mapped[bool] = mapped_column(default=True)
     owner_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    # bumped on every change, the ETag of album reads is derived from it
+    version: Mapped[int] = mapped_column(default=1, server_default="1")
 
     photos: Mapped[List["Photo"]] = relationship(back_populates="album")
     owner: Mapped["User"] = relationship(back_populates="own_albums")
@@ -49,16 +74,113 @@ class Album(Base):
 
 class Photo(Base):
     __tablename__ = "photos"
+    __table_args__ = (Index("ix_photos_uploaded_by_id_id", "uploaded_by_id", "id"),)
 
     id: Mapped[int] = mapped_column(primary_key=True)
     title: Mapped[str] = mapped_column(index=True)
     description: Mapped[str] = mapped_column()
-    file = Column(ImageType(storage=storage))
+    file = Column(ContentImageType(storage=storage))
     album_id: Mapped[int | None] = mapped_column(ForeignKey("albums.id"))
     uploaded_by_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    face_count: Mapped[int | None] = mapped_column()
+    # number of user_to_photo rows, maintained by PhotoStorage.link_users
+    people_count: Mapped[int] = mapped_column(default=0, server_default="0")
+    processing_status: Mapped[ProcessingStatus] = mapped_column(
+        Enum(ProcessingStatus, native_enum=False, length=16),
+        default=ProcessingStatus.pending,
+        server_default=ProcessingStatus.pending.value,
+        index=True,
+    )
+    processing_error: Mapped[str | None] = mapped_column()
+    # when a worker claimed the photo, see PhotoStorage.claim_photo
+    processing_started_at: Mapped[datetime | None] = mapped_column(
+        DateTime(timezone=True)
+    )
+    # bumped on every change including user_to_photo links, see _add_people
+    version: Mapped[int] = mapped_column(default=1, server_default="1")
 
     uploaded_by: Mapped["User"] = relationship(back_populates="uploaded_photos")
     album: Mapped["Album"] = relationship(back_populates="photos")
     users: Mapped[List["User"]] = relationship(
         secondary="user_to_photo", back_populates="on_photos"
     )
+    faces: Mapped[List["FaceEmbedding"]] = relationship(
+        back_populates="photo", cascade="all, delete-orphan", passive_deletes=True
+    )
+
+
+Index(
+    "ix_photos_uploaded_by_id_single_owner",
+    Photo.uploaded_by_id,
+    postgresql_where=Photo.people_count == 1,
+    sqlite_where=Photo.people_count == 1,
+)
+
+
+@event.listens_for(Album, "before_update")
+@event.listens_for(Photo, "before_update")
+def bump_version(mapper, connection, target):
+    # core UPDATEs of these tables bump the version themselves
+    if object_session(target).is_modified(target, include_collections=False):
+        target.version = type(target).version + 1
+
+
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    # storage key of a photo file, see ContentAddressedStorage
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    refcount: Mapped[int] = mapped_column(default=0)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), index=True
+    )
+
+
+class FaceCluster(Base):
+    __tablename__ = "face_clusters"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    owner_id: Mapped[int] = mapped_column(
+        ForeignKey("users.id", ondelete="CASCADE"), index=True
+    )
+    # faces assigned so far, the weight of centroid in the running mean
+    size: Mapped[int] = mapped_column(default=0)
+    centroid: Mapped[bytes] = mapped_column(LargeBinary)
+
+    faces: Mapped[List["FaceEmbedding"]] = relationship(back_populates="cluster")
+
+    @property
+    def vector(self) -> np.ndarray:
+        return np.frombuffer(self.centroid, dtype=np.float64)
+
+
+class FaceEmbedding(Base):
+    __tablename__ = "face_embeddings"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    photo_id: Mapped[int] = mapped_column(
+        ForeignKey("photos.id", ondelete="CASCADE"), index=True
+    )
+    face_index: Mapped[int] = mapped_column()
+    top: Mapped[int] = mapped_column()
+    right: Mapped[int] = mapped_column()
+    bottom: Mapped[int] = mapped_column()
+    left: Mapped[int] = mapped_column()
+    encoding: Mapped[bytes] = mapped_column(LargeBinary)
+    model_version: Mapped[str] = mapped_column()
+    # NULL until the clustering job has seen the face
+    cluster_id: Mapped[int | None] = mapped_column(
+        ForeignKey("face_clusters.id", ondelete="SET NULL"), index=True
+    )
+    # nearest enrolled user found by the auto-tag stage
+    suggested_user_id: Mapped[int | None] = mapped_column(
+        ForeignKey("users.id", ondelete="SET NULL")
+    )
+    suggested_distance: Mapped[float | None] = mapped_column()
+
+    photo: Mapped["Photo"] = relationship(back_populates="faces")
+    cluster: Mapped["FaceCluster"] = relationship(back_populates="faces")
+
+    @property
+    def vector(self) -> np.ndarray:
+        return np.frombuffer(self.encoding, dtype=np.float64)
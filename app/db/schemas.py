@@ -23,12 +23,33 @@ class PhotoCreate(PhotoBase):
 
 class Photo(PhotoBase):
     id: int
-    file: str
+    file: str | None
     album_id: int | None = None
     uploaded_by_id: int
     users: list[UserForPhoto] | None
 
 
+class PhotoUpload(BaseModel):
+    filename: str | None
+    id: int | None = None
+    file: str | None = None
+    processing_status: str | None = None
+    error: str | None = None
+
+
+class PhotoConfirmation(BaseModel):
+    photo_id: int
+    accepted: bool
+    reason: str | None = None
+
+
+class PhotoProcessing(BaseModel):
+    id: int
+    processing_status: str
+    processing_error: str | None = None
+    face_count: int | None = None
+
+
 class UserCreate(UserBase):
     password: str
 
@@ -65,6 +86,53 @@ class AlbumUpdate(AlbumBase):
     is_display: bool
 
 
-class Album(AlbumBase):
+class AlbumShort(AlbumBase):
+    id: int
     is_display: bool = True
+    owner_id: int
+
+
+class Album(AlbumShort):
     photos: list[Photo] = []
+
+
+class FaceBox(BaseModel):
+    top: int
+    right: int
+    bottom: int
+    left: int
+
+
+class FaceCandidate(BaseModel):
+    user_id: int
+    distance: float
+
+
+class IdentifiedFace(BaseModel):
+    box: FaceBox
+    candidates: list[FaceCandidate]
+
+
+class FaceTag(BaseModel):
+    face_id: int
+    user_id: int
+    distance: float
+    box: FaceBox
+    linked: bool
+
+
+class PhotoIdentification(BaseModel):
+    photo_id: int
+    faces: list[IdentifiedFace]
+
+
+class ClusterFace(BaseModel):
+    face_id: int
+    photo_id: int
+    box: FaceBox
+
+
+class FaceCluster(BaseModel):
+    id: int
+    size: int
+    faces: list[ClusterFace]
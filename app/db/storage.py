@@ -0,0 +1,100 @@
+import hashlib
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Any, BinaryIO
+
+from fastapi_storages import FileSystemStorage, StorageFile
+from fastapi_storages.exceptions import ValidationException
+from fastapi_storages.integrations.sqlalchemy import ImageType
+from PIL import Image, UnidentifiedImageError
+
+from app.core.timing import span
+
+SUFFIX_RE = re.compile(r"^\.[a-z0-9]{1,8}$")
+
+
+# Files are stored once per content under ab/cd/<sha256><suffix>, the blobs
+# table counts the photos referencing each key (see crud.BlobStorage).
+class ContentAddressedStorage(FileSystemStorage):
+    OVERWRITE_EXISTING_FILES = True
+
+    def get_name(self, name: str) -> str:
+        # keys are generated here, older rows hold flat file names
+        return name
+
+    @staticmethod
+    def make_key(digest: str, filename: str | None) -> str:
+        suffix = Path(filename or "").suffix.lower()
+        suffix = suffix if SUFFIX_RE.match(suffix) else ""
+        return f"{digest[:2]}/{digest[2:4]}/{digest}{suffix}"
+
+    def stage(self, file: BinaryIO, filename: str | None) -> tuple[str, str]:
+        # copies the file next to the stored ones and hashes it in the same
+        # pass, place() moves the copy under its key
+        digest = hashlib.sha256()
+        file.seek(0)
+        fd, tmp_path = tempfile.mkstemp(dir=self._path, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as output:
+                while chunk := file.read(self.default_chunk_size):
+                    digest.update(chunk)
+                    output.write(chunk)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return self.make_key(digest.hexdigest(), filename), tmp_path
+
+    def place(self, key: str, tmp_path: str):
+        path = self._path / key
+        # a duplicate keeps the stored file, its copy is dropped
+        if path.exists():
+            os.unlink(tmp_path)
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # concurrent uploads of the same content never see a partial file
+        os.replace(tmp_path, path)
+
+    def discard(self, tmp_path: str):
+        Path(tmp_path).unlink(missing_ok=True)
+
+    def store(self, file: BinaryIO, filename: str | None) -> str:
+        with span("storage_write"):
+            key, tmp_path = self.stage(file, filename)
+            self.place(key, tmp_path)
+            return key
+
+    def write(self, file: BinaryIO, name: str) -> str:
+        return str(self._path / self.store(file, name))
+
+    def delete(self, key: str):
+        (self._path / key).unlink(missing_ok=True)
+
+
+class ContentImageType(ImageType):
+    cache_ok = True
+
+    def process_bind_param(self, value: Any, dialect) -> str | None:
+        if value is None:
+            return value
+        # an already stored file, e.g. copied from another photo
+        if isinstance(value, StorageFile):
+            return value.name
+        if isinstance(value, str):
+            return value
+        # a file written here would have no blob ref and could be collected
+        raise TypeError("uploads are stored with PhotoStorage.store_files")
+
+    def prepare(self, value: Any) -> tuple[str, str] | None:
+        # checks an upload and stages it, returns its key and the staged copy
+        if len(value.file.read(1)) != 1:
+            return None
+        try:
+            value.file.seek(0)
+            with Image.open(value.file) as image:
+                image.verify()
+        except UnidentifiedImageError:
+            raise ValidationException("Invalid image file")
+        with span("storage_write"):
+            return self.storage.stage(value.file, value.filename)
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+
+import numpy as np
+
+from app.core.config import settings
+from app.db.crud import FaceClusterStorage
+from app.db.database import SessionLocal
+from app.face_id.prototypes import ENCODING_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+def squared_distances(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # |a - b|^2 = |a|^2 - 2ab + |b|^2 for all pairs at once
+    return (a**2).sum(axis=1)[:, None] - 2 * a @ b.T + (b**2).sum(axis=1)[None, :]
+
+
+def connected_components(adjacency: np.ndarray) -> np.ndarray:
+    # every node takes the smallest label among its neighbours until nothing
+    # changes, each component ends up labelled by its smallest node
+    labels = np.arange(len(adjacency))
+    while True:
+        updated = np.where(adjacency, labels[None, :], len(labels)).min(axis=1)
+        updated = updated[updated]
+        if (updated == labels).all():
+            return labels
+        labels = updated
+
+
+def assign_clusters(
+    encodings: np.ndarray,
+    centroids: np.ndarray,
+    sizes: np.ndarray,
+    tolerance: float,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Returns the cluster position of every encoding with the updated
+    # centroids and sizes, positions past the given centroids are new clusters.
+    # A face joins the nearest existing cluster within tolerance, the rest are
+    # grouped by single linkage (DBSCAN with min_samples=1) among themselves.
+    encodings = np.asarray(encodings, dtype=np.float64).reshape(-1, ENCODING_SIZE)
+    centroids = np.asarray(centroids, dtype=np.float64).reshape(-1, ENCODING_SIZE)
+    sizes = np.asarray(sizes, dtype=np.int64)
+    positions = np.full(len(encodings), -1)
+    if len(centroids) and len(encodings):
+        squared = squared_distances(encodings, centroids)
+        nearest = squared.argmin(axis=1)
+        matched = squared[np.arange(len(encodings)), nearest] <= tolerance**2
+        positions[matched] = nearest[matched]
+    rest = np.flatnonzero(positions < 0)
+    if len(rest):
+        components = connected_components(
+            squared_distances(encodings[rest], encodings[rest]) <= tolerance**2
+        )
+        _, new = np.unique(components, return_inverse=True)
+        positions[rest] = len(centroids) + new
+
+    count = max(len(centroids), positions.max(initial=-1) + 1)
+    totals = np.zeros((count, ENCODING_SIZE))
+    totals[: len(centroids)] = centroids * sizes[:, None]
+    np.add.at(totals, positions, encodings)
+    new_sizes = np.zeros(count, dtype=np.int64)
+    new_sizes[: len(sizes)] = sizes
+    np.add.at(new_sizes, positions, 1)
+    return positions, totals / np.maximum(new_sizes, 1)[:, None], new_sizes
+
+
+class FaceClusterer:
+    def __init__(self, interval: float, chunk_size: int, tolerance: float):
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.tolerance = tolerance
+        self.session_factory = SessionLocal
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def shutdown(self):
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    async def cluster_owner(self, owner_id: int) -> int:
+        # only faces without a cluster are read, earlier runs are kept as is
+        async with self.session_factory() as session:
+            if not await FaceClusterStorage.lock_owner(session, owner_id):
+                return 0
+            clusters = await FaceClusterStorage.get_owner_clusters(session, owner_id)
+            cluster_ids = [cluster.id for cluster in clusters]
+            centroids = np.asarray([cluster.vector for cluster in clusters])
+            sizes = np.asarray([cluster.size for cluster in clusters])
+            clustered = 0
+            while rows := await FaceClusterStorage.get_unclustered_faces(
+                session, owner_id, self.chunk_size
+            ):
+                encodings = np.asarray(
+                    [np.frombuffer(encoding, dtype=np.float64) for _, encoding in rows]
+                )
+                positions, centroids, sizes = await asyncio.to_thread(
+                    assign_clusters, encodings, centroids, sizes, self.tolerance
+                )
+                known = len(cluster_ids)
+                touched = np.unique(positions[positions < known])
+                await FaceClusterStorage.update_clusters(
+                    session,
+                    [cluster_ids[position] for position in touched],
+                    centroids[touched],
+                    sizes[touched],
+                )
+                cluster_ids.extend(
+                    await FaceClusterStorage.create_clusters(
+                        session, owner_id, centroids[known:], sizes[known:]
+                    )
+                )
+                await FaceClusterStorage.set_face_clusters(
+                    session,
+                    [face_id for face_id, _ in rows],
+                    [cluster_ids[position] for position in positions],
+                )
+                clustered += len(rows)
+            await session.commit()
+        return clustered
+
+    async def cluster(self) -> int:
+        async with self.session_factory() as session:
+            owner_ids = await FaceClusterStorage.get_owners_with_unclustered_faces(
+                session
+            )
+        return sum([await self.cluster_owner(owner_id) for owner_id in owner_ids])
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                clustered = await self.cluster()
+                if clustered:
+                    logger.info("Clustered %s new faces", clustered)
+            except Exception:
+                logger.exception("Face clustering failed")
+
+
+face_clusterer = FaceClusterer(
+    interval=settings.FACE_CLUSTER_INTERVAL_SECONDS,
+    chunk_size=settings.FACE_CLUSTER_CHUNK_SIZE,
+    tolerance=settings.FACE_CLUSTER_TOLERANCE,
+)
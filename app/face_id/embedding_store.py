@@ -0,0 +1,282 @@
+import fcntl
+import os
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from app.core.config import settings
+from app.face_id.index import FaceIndex, face_index
+from app.face_id.prototypes import ENCODING_SIZE
+
+
+# Append-only store of confirmed face encodings shared by all workers of a
+# host. A generation directory holds raw files appended in this order:
+#   vectors.f32     float32 rows of ENCODING_SIZE
+#   labels.i64      user id per row
+#   ids.i64         face embedding id per row, written last so its size is
+#                   the number of complete rows
+#   tombstones.i64  ids of deleted faces
+# and, written once with the generation, its IVF layout (FaceIndex.layout):
+#   centroids.f32   float32 rows of ENCODING_SIZE
+#   offsets.i64     bucket bounds of the rows written with the generation,
+#                   which are sorted by bucket
+# Readers np.memmap the files read-only and search them in place, the pages
+# are shared through the OS page cache. Compaction writes a new generation,
+# laid out again, and switches CURRENT to it,
+# the superseded one is removed by the compaction after that, so a reader that
+# read CURRENT just before the switch can still open its files.
+class EmbeddingStore:
+    def __init__(
+        self, path: Path, compact_ratio: float = 0.25, index: FaceIndex | None = None
+    ):
+        self.path = Path(path)
+        self.compact_ratio = compact_ratio
+        # lays out new generations, its nlist and min_train_size apply
+        self.index = FaceIndex() if index is None else index
+        self._reset()
+
+    def _reset(self):
+        self.generation: str | None = None
+        self.ids = np.empty(0, dtype=np.int64)
+        self.labels = np.empty(0, dtype=np.int64)
+        self.vectors = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+        self.tombstones = np.empty(0, dtype=np.int64)
+        self.centroids = np.zeros((1, ENCODING_SIZE), dtype=np.float32)
+        self.offsets = np.zeros(2, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def _current(self) -> Path:
+        return self.path / "CURRENT"
+
+    def _generation_path(self, generation: str | None = None) -> Path:
+        return self.path / (generation or self.generation)
+
+    @contextmanager
+    def _lock(self):
+        # appends and compaction may come from several worker processes
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / "lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_generation(self) -> str | None:
+        try:
+            return self._current.read_text().strip()
+        except FileNotFoundError:
+            return None
+
+    def _switch(self, generation: str):
+        tmp = self.path / "CURRENT.tmp"
+        tmp.write_text(generation)
+        os.replace(tmp, self._current)
+
+    @staticmethod
+    def _map(path: Path, dtype, rows: int, shape=()) -> np.ndarray:
+        if not rows:
+            return np.empty((0, *shape), dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", shape=(rows, *shape))
+
+    def refresh(self) -> bool:
+        # cheap when nothing changed: reads CURRENT and stats two files
+        missing = None
+        while True:
+            generation = self._read_generation()
+            if generation is None:
+                changed = self.generation is not None
+                self._reset()
+                return changed
+            try:
+                return self._open(generation)
+            except FileNotFoundError:
+                # removed between reading CURRENT and opening the files, the
+                # store was cleared or compacted twice in between
+                if generation == missing:
+                    raise
+                missing = generation
+
+    def _open(self, generation: str) -> bool:
+        path = self._generation_path(generation)
+        rows = os.stat(path / "ids.i64").st_size // 8
+        tombstones = os.stat(path / "tombstones.i64").st_size // 8
+        if (
+            generation == self.generation
+            and rows == len(self.ids)
+            and tombstones == len(self.tombstones)
+        ):
+            return False
+        if generation != self.generation:
+            layout = (
+                np.fromfile(path / "centroids.f32", dtype=np.float32),
+                np.fromfile(path / "offsets.i64", dtype=np.int64),
+            )
+        else:
+            layout = (self.centroids, self.offsets)
+        # nothing is replaced until every file of the generation is open
+        mapped = (
+            self._map(path / "ids.i64", np.int64, rows),
+            self._map(path / "labels.i64", np.int64, rows),
+            self._map(path / "vectors.f32", np.float32, rows, (ENCODING_SIZE,)),
+            self._map(path / "tombstones.i64", np.int64, tombstones),
+        )
+        self.generation = generation
+        self.ids, self.labels, self.vectors, self.tombstones = mapped
+        self.centroids = layout[0].reshape(-1, ENCODING_SIZE)
+        self.offsets = layout[1]
+        return True
+
+    def live(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        mask = ~np.isin(self.ids, self.tombstones)
+        if mask.all():
+            return self.ids, self.labels, self.vectors
+        return self.ids[mask], self.labels[mask], self.vectors[mask]
+
+    @staticmethod
+    def _append(path: Path, values, dtype):
+        with open(path, "ab") as file:
+            file.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+
+    @staticmethod
+    def _truncate(path: Path):
+        # A writer that died mid-append leaves vectors or labels past the last
+        # complete id, the next append would shift them against ids.i64.
+        # Readers map only the rows in ids.i64 and never see them.
+        if not (path / "ids.i64").exists():
+            return
+        rows = os.stat(path / "ids.i64").st_size // 8
+        for name, row_size in (
+            ("vectors.f32", ENCODING_SIZE * 4),
+            ("labels.i64", 8),
+            ("ids.i64", 8),
+        ):
+            if os.stat(path / name).st_size > rows * row_size:
+                os.truncate(path / name, rows * row_size)
+        tombstones = os.stat(path / "tombstones.i64").st_size
+        os.truncate(path / "tombstones.i64", tombstones - tombstones % 8)
+
+    def _write(self, generation: str, ids, labels, vectors, tombstones=()):
+        # called under the lock
+        path = self._generation_path(generation)
+        path.mkdir(parents=True, exist_ok=True)
+        self._truncate(path)
+        self._append(path / "vectors.f32", vectors, np.float32)
+        self._append(path / "labels.i64", labels, np.int64)
+        self._append(path / "ids.i64", ids, np.int64)
+        self._append(path / "tombstones.i64", tombstones, np.int64)
+
+    def _create(self, generation: str, ids, labels, vectors):
+        ids = np.asarray(ids, dtype=np.int64)
+        labels = np.asarray(labels, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        centroids, order, offsets = self.index.layout(vectors)
+        path = self._generation_path(generation)
+        shutil.rmtree(path, ignore_errors=True)
+        self._write(generation, ids[order], labels[order], vectors[order])
+        self._append(path / "centroids.f32", centroids, np.float32)
+        self._append(path / "offsets.i64", offsets, np.int64)
+
+    def _replace(self, ids, labels, vectors):
+        previous = self._read_generation()
+        number = int(previous.split("-")[1]) + 1 if previous else 1
+        generation = f"gen-{number:06d}"
+        self._create(generation, ids, labels, vectors)
+        self._switch(generation)
+        # open memmaps keep removed files alive until they are dropped, the
+        # previous generation is kept for readers about to open it
+        for path in self.path.glob("gen-*"):
+            if path.name not in (generation, previous):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def rebuild(self, ids, labels, vectors):
+        with self._lock():
+            self._replace(ids, labels, vectors)
+        self.refresh()
+
+    def append(self, ids, labels, vectors):
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(ids):
+            return
+        with self._lock():
+            generation = self._read_generation()
+            if generation is None:
+                generation = "gen-000001"
+                self._create(generation, [], [], np.empty((0, ENCODING_SIZE)))
+                self._switch(generation)
+            vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+            self._write(generation, ids, labels, vectors)
+
+    def delete(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(ids):
+            return
+        with self._lock():
+            generation = self._read_generation()
+            if generation is None:
+                return
+            self._write(generation, [], [], np.empty((0, ENCODING_SIZE)), ids)
+
+    def clear(self):
+        # the store is derived from the database, the next reader rebuilds it
+        with self._lock():
+            self._current.unlink(missing_ok=True)
+            for path in self.path.glob("gen-*"):
+                shutil.rmtree(path, ignore_errors=True)
+        self._reset()
+
+    @property
+    def exists(self) -> bool:
+        return self._current.exists()
+
+    def needs_compaction(self) -> bool:
+        # too many deleted rows, or the rows appended since the layout doubled
+        # the library and the buckets are retrained
+        deleted = len(self.tombstones) > self.compact_ratio * max(len(self.ids), 1)
+        return deleted or self.index.needs_training(int(self.offsets[-1]), len(self))
+
+    def compact(self):
+        with self._lock():
+            self.refresh()
+            # another worker may have compacted while this one waited
+            if self.needs_compaction():
+                self._replace(*self.live())
+        self.refresh()
+
+
+# remembers which generation an index is attached to and how many of its
+# tombstones it has applied, a refresh only indexes what was appended since
+class StoreCursor:
+    def __init__(self):
+        self.generation: str | None = None
+        self.tombstones = 0
+
+    def apply(self, store: EmbeddingStore, index: FaceIndex):
+        if not index.is_loaded or store.generation != self.generation:
+            index.attach(
+                store.ids,
+                store.labels,
+                store.vectors,
+                store.centroids,
+                store.offsets,
+                store.tombstones,
+            )
+        else:
+            index.extend(store.ids, store.labels, store.vectors)
+            index.remove_many(store.tombstones[self.tombstones :])
+        self.generation = store.generation
+        self.tombstones = len(store.tombstones)
+
+
+embedding_store = EmbeddingStore(
+    settings.embedding_dir,
+    compact_ratio=settings.FACE_EMBEDDING_COMPACT_RATIO,
+    index=face_index,
+)
@@ -0,0 +1,80 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Any, Callable, TypeVar
+
+from app.core.config import settings
+
+T = TypeVar("T")
+
+
+def _init_worker():
+    # face_recognition loads the dlib detector and encoder models on import,
+    # do it once per worker process instead of on the first request
+    import face_recognition  # noqa: F401
+
+
+def _warm_up() -> int:
+    import face_recognition
+    import numpy as np
+
+    # the first detection and encoding still allocate dlib's buffers
+    image = np.zeros((128, 128, 3), dtype=np.uint8)
+    face_recognition.face_locations(image)
+    face_recognition.face_encodings(image, [(16, 112, 112, 16)])
+    return os.getpid()
+
+
+class FaceEngine:
+    def __init__(self, max_workers: int, max_concurrency: int):
+        self.max_workers = max_workers
+        self.max_concurrency = max_concurrency
+        self._executor: ProcessPoolExecutor | None = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    @property
+    def is_running(self) -> bool:
+        return self._executor is not None
+
+    def start(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+
+    async def warmup(self) -> int:
+        # one call per worker, the pool spawns a process while none is idle
+        pids = await asyncio.gather(
+            *(self.run(_warm_up) for _ in range(self.max_workers))
+        )
+        return len(set(pids))
+
+    async def shutdown(self):
+        if self._executor is None:
+            return
+        executor, self._executor = self._executor, None
+        await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        async with self._semaphore:
+            self.start()
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(
+                    self._executor, partial(fn, *args, **kwargs)
+                )
+            except BrokenProcessPool:
+                # a worker died (e.g. OOM on a huge image), next call gets a new pool
+                self._executor = None
+                raise
+
+
+face_engine = FaceEngine(
+    max_workers=settings.FACE_ENGINE_WORKERS,
+    max_concurrency=settings.FACE_ENGINE_MAX_CONCURRENCY,
+)
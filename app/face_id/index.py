@@ -0,0 +1,237 @@
+import asyncio
+from typing import NamedTuple, Sequence
+
+import numpy as np
+
+from app.core.config import settings
+from app.face_id.prototypes import ENCODING_SIZE
+
+
+class Neighbour(NamedTuple):
+    key: int
+    label: int
+    distance: float
+
+
+def _grow(array: np.ndarray, size: int) -> np.ndarray:
+    # room for size rows, copied with doubled capacity when it runs out
+    if size <= len(array):
+        return array
+    grown = np.zeros((max(size, 2 * len(array), 16), *array.shape[1:]), array.dtype)
+    grown[: len(array)] = array
+    return grown
+
+
+def assign(
+    centroids: np.ndarray, vectors: np.ndarray, chunk_size: int = 4096
+) -> np.ndarray:
+    centroid_norms = (centroids**2).sum(axis=1)
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = vectors[start : start + chunk_size]
+        distances = centroid_norms - 2 * chunk @ centroids.T
+        assignment[start : start + chunk_size] = distances.argmin(axis=1)
+    return assignment
+
+
+# IVF index: vectors are bucketed by their nearest k-means centroid and a
+# query scans only the nprobe closest buckets. Below min_train_size there is
+# a single bucket and search is exact.
+# Rows are laid out sorted by bucket, offsets[i]:offsets[i + 1] are the rows
+# of bucket i and rows added later are listed per bucket in tails. The rows
+# are not copied, they may be the memmaps of the embedding store; removed
+# rows are masked until the next build.
+class FaceIndex:
+    def __init__(self, nlist: int = 0, nprobe: int = 8, min_train_size: int = 1024):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.is_loaded = False
+        self.lock = asyncio.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.keys = np.empty(0, dtype=np.int64)
+        self.labels = np.empty(0, dtype=np.int64)
+        self.vectors = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+        self.removed = np.empty(0, dtype=bool)
+        self.size = 0
+        self.centroids = np.zeros((1, ENCODING_SIZE), dtype=np.float32)
+        self.offsets = np.zeros(2, dtype=np.int64)
+        self.tails: list[list[int]] = [[]]
+        self._live = 0
+
+    def clear(self):
+        self._reset()
+        self.is_loaded = False
+
+    def __len__(self) -> int:
+        return self._live
+
+    def layout(self, vectors: np.ndarray):
+        # centroids, the order sorting the rows by bucket and the bucket offsets
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        if len(vectors) >= self.min_train_size:
+            centroids = self._train(vectors)
+        else:
+            centroids = np.zeros((1, ENCODING_SIZE), dtype=np.float32)
+        assignment = assign(centroids, vectors)
+        order = np.argsort(assignment, kind="stable")
+        offsets = np.searchsorted(assignment[order], np.arange(len(centroids) + 1))
+        return centroids, order, offsets
+
+    def needs_training(self, laid_out: int, size: int) -> bool:
+        # retrain once the library doubled since the last layout
+        return size >= max(self.min_train_size, 2 * laid_out)
+
+    def build(self, keys, labels, vectors):
+        keys = np.asarray(keys, dtype=np.int64)
+        labels = np.asarray(labels, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        centroids, order, offsets = self.layout(vectors)
+        self.attach(keys[order], labels[order], vectors[order], centroids, offsets)
+
+    def attach(
+        self,
+        keys: np.ndarray,
+        labels: np.ndarray,
+        vectors: np.ndarray,
+        centroids: np.ndarray,
+        offsets: np.ndarray,
+        removed_keys: Sequence[int] = (),
+    ):
+        # rows up to offsets[-1] follow the layout, the rest are added after
+        self._reset()
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.tails = [[] for _ in range(len(self.centroids))]
+        self.size = self._live = int(self.offsets[-1])
+        self.removed = np.zeros(self.size, dtype=bool)
+        self.extend(keys, labels, vectors)
+        self.remove_many(removed_keys)
+        self.is_loaded = True
+
+    def extend(
+        self,
+        keys: np.ndarray,
+        labels: np.ndarray,
+        vectors: np.ndarray,
+        size: int | None = None,
+    ):
+        # the arrays hold the rows indexed so far followed by new ones, e.g.
+        # the embedding store files mapped again after an append
+        start, end = self.size, len(keys) if size is None else size
+        self.keys, self.labels, self.vectors = keys, labels, vectors
+        if end <= start:
+            return
+        self.removed = _grow(self.removed, end)
+        self.size = end
+        self._live += end - start
+        new_keys = np.asarray(keys[start:end])
+        assignment = assign(self.centroids, np.asarray(vectors[start:end]))
+        for list_no in np.unique(assignment):
+            rows = start + np.flatnonzero(assignment == list_no)
+            self.tails[list_no].extend(rows.tolist())
+        # a key added again replaces its earlier row
+        _, last = np.unique(new_keys[::-1], return_index=True)
+        kept = np.zeros(end - start, dtype=bool)
+        kept[end - start - 1 - last] = True
+        replaced = np.flatnonzero(np.isin(keys[:start], new_keys))
+        self._remove_rows(np.concatenate([replaced, start + np.flatnonzero(~kept)]))
+
+    def add(self, key: int, label: int, vector: np.ndarray):
+        size = self.size + 1
+        keys, labels = _grow(self.keys, size), _grow(self.labels, size)
+        vectors = _grow(self.vectors, size)
+        keys[self.size], labels[self.size], vectors[self.size] = key, label, vector
+        self.extend(keys, labels, vectors, size)
+        if self.needs_training(int(self.offsets[-1]), len(self)):
+            self._retrain()
+
+    def remove(self, key: int):
+        self.remove_many([key])
+
+    def remove_many(self, keys: Sequence[int]):
+        if len(keys):
+            self._remove_rows(np.flatnonzero(np.isin(self.keys[: self.size], keys)))
+
+    def _remove_rows(self, rows: np.ndarray):
+        rows = rows[~self.removed[rows]]
+        self.removed[rows] = True
+        self._live -= len(rows)
+
+    def search(
+        self, queries: np.ndarray, k: int, max_distance: float | None = None
+    ) -> list[list[Neighbour]]:
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        nprobe = min(self.nprobe, len(self.centroids))
+        centroid_distances = np.linalg.norm(
+            queries[:, None, :] - self.centroids[None, :, :], axis=2
+        )
+        probes = np.argsort(centroid_distances, axis=1)[:, :nprobe]
+
+        results = []
+        for query, query_probes in zip(queries, probes):
+            rows, distances = [], []
+            for list_no in query_probes:
+                # slices of the laid out rows are views, tails are gathered
+                start, end = self.offsets[list_no], self.offsets[list_no + 1]
+                tail = np.asarray(self.tails[list_no], dtype=np.int64)
+                for bucket_rows, vectors in (
+                    (np.arange(start, end), self.vectors[start:end]),
+                    (tail, self.vectors[tail]),
+                ):
+                    if len(bucket_rows):
+                        rows.append(bucket_rows)
+                        distances.append(np.linalg.norm(vectors - query, axis=1))
+            if not rows:
+                results.append([])
+                continue
+            rows, distances = np.concatenate(rows), np.concatenate(distances)
+            live = ~self.removed[rows]
+            rows, distances = rows[live], distances[live]
+            top = min(k, len(distances))
+            if not top:
+                results.append([])
+                continue
+            nearest = np.argpartition(distances, top - 1)[:top]
+            nearest = nearest[np.argsort(distances[nearest])]
+            results.append(
+                [
+                    Neighbour(
+                        int(self.keys[rows[i]]),
+                        int(self.labels[rows[i]]),
+                        float(distances[i]),
+                    )
+                    for i in nearest
+                    if max_distance is None or distances[i] <= max_distance
+                ]
+            )
+        return results
+
+    def _retrain(self):
+        live = np.flatnonzero(~self.removed[: self.size])
+        self.build(self.keys[live], self.labels[live], self.vectors[live])
+
+    def _train(self, vectors: np.ndarray, iterations: int = 10) -> np.ndarray:
+        # a configured nlist can exceed a small library
+        nlist = max(min(self.nlist or int(np.sqrt(len(vectors))), len(vectors)), 1)
+        rng = np.random.default_rng(0)
+        sample_size = min(len(vectors), nlist * 64)
+        sample = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+        for _ in range(iterations):
+            assignment = assign(centroids, sample)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            counts = np.bincount(assignment, minlength=nlist)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+        return centroids
+
+
+face_index = FaceIndex(
+    nlist=settings.FACE_INDEX_NLIST,
+    nprobe=settings.FACE_INDEX_NPROBE,
+    min_train_size=settings.FACE_INDEX_MIN_TRAIN_SIZE,
+)
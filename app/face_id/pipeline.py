@@ -0,0 +1,111 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from app.core.config import settings
+from app.db.crud import PhotoStorage
+from app.db.database import SessionLocal
+from app.db.models import ProcessingStatus
+from app.face_id.service import auto_tag_photo, get_photo_analysis
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionPipeline:
+    def __init__(self, workers: int, max_queue_size: int, lease: float):
+        self.workers = workers
+        self.max_queue_size = max_queue_size
+        self.lease = lease
+        self.session_factory = SessionLocal
+        self._queue: asyncio.Queue[int] | None = None
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def is_running(self) -> bool:
+        return self._queue is not None
+
+    async def start(self):
+        if self.is_running:
+            return
+        self._queue = asyncio.Queue(self.max_queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._requeue_unprocessed()))
+
+    async def shutdown(self):
+        # interrupted photos stay "processing" until their lease expires
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    def submit(self, photo_id: int) -> bool:
+        if self._queue is None:
+            return False
+        try:
+            self._queue.put_nowait(photo_id)
+        except asyncio.QueueFull:
+            # stays pending in the database until the next start
+            return False
+        return True
+
+    def expired_before(self) -> datetime:
+        return datetime.now(timezone.utc) - timedelta(seconds=self.lease)
+
+    async def process(self, photo_id: int):
+        async with self.session_factory() as session:
+            # done, or being processed by another worker
+            if not await PhotoStorage.claim_photo(
+                session, photo_id, self.expired_before()
+            ):
+                return
+            photo = await PhotoStorage.get_photo(session, photo_id)
+            if photo is None:
+                return
+            try:
+                await get_photo_analysis(session, photo)
+            except Exception as e:
+                await session.rollback()
+                await PhotoStorage.set_processing_status(
+                    session, photo, ProcessingStatus.failed, error=repr(e)
+                )
+                raise
+            if settings.AUTO_TAG_MODE != "off":
+                try:
+                    await auto_tag_photo(session, photo)
+                except Exception:
+                    # the analysis is stored, tagging is retried on reprocessing
+                    await session.rollback()
+                    logger.exception("Auto-tagging of photo %s failed", photo_id)
+            await PhotoStorage.set_processing_status(
+                session, photo, ProcessingStatus.done
+            )
+
+    async def _requeue_unprocessed(self):
+        # also picks up claims of workers that died in other processes, photos
+        # queued twice are skipped by the claim
+        while True:
+            async with self.session_factory() as session:
+                photo_ids = await PhotoStorage.get_unprocessed_photo_ids(
+                    session, self.expired_before()
+                )
+            for photo_id in photo_ids:
+                await self._queue.put(photo_id)
+            await asyncio.sleep(self.lease)
+
+    async def _worker(self):
+        while True:
+            photo_id = await self._queue.get()
+            try:
+                await self.process(photo_id)
+            except Exception:
+                logger.exception("Processing of photo %s failed", photo_id)
+            finally:
+                self._queue.task_done()
+
+
+ingestion_pipeline = IngestionPipeline(
+    workers=settings.INGESTION_WORKERS,
+    max_queue_size=settings.INGESTION_QUEUE_SIZE,
+    lease=settings.INGESTION_LEASE_SECONDS,
+)
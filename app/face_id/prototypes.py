@@ -0,0 +1,97 @@
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+ENCODING_SIZE = 128
+
+
+class UserPrototype:
+    def __init__(self, encodings: np.ndarray | None = None):
+        encodings = (
+            np.empty((0, ENCODING_SIZE))
+            if encodings is None
+            else np.asarray(encodings, dtype=np.float64).reshape(-1, ENCODING_SIZE)
+        )
+        self.size = len(encodings)
+        self._data = np.empty((max(self.size, 8), ENCODING_SIZE))
+        self._data[: self.size] = encodings
+        self.centroid = encodings.mean(axis=0) if self.size else np.zeros(ENCODING_SIZE)
+        self.loaded_at = time.monotonic()
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._data[: self.size]
+
+    def add(self, encoding: np.ndarray):
+        if self.size == len(self._data):
+            self._data = np.resize(self._data, (self.size * 2, ENCODING_SIZE))
+        self._data[self.size] = encoding
+        self.size += 1
+        self.centroid += (encoding - self.centroid) / self.size
+
+    def distances(self, encoding: np.ndarray) -> np.ndarray:
+        return np.linalg.norm(self.matrix - encoding, axis=1)
+
+    def verify(
+        self, encoding: np.ndarray, tolerance: float, centroid_first: bool = False
+    ) -> bool:
+        # nothing confirmed yet, the first photo defines the person
+        if not self.size:
+            return True
+        if centroid_first and np.linalg.norm(self.centroid - encoding) <= tolerance:
+            return True
+        return bool((self.distances(encoding) <= tolerance).any())
+
+    def verify_many(
+        self, encodings: np.ndarray, tolerance: float, centroid_first: bool = False
+    ) -> np.ndarray:
+        encodings = np.asarray(encodings, dtype=np.float64).reshape(-1, ENCODING_SIZE)
+        if not self.size:
+            return np.ones(len(encodings), dtype=bool)
+        accepted = np.zeros(len(encodings), dtype=bool)
+        if centroid_first:
+            accepted = np.linalg.norm(encodings - self.centroid, axis=1) <= tolerance
+        rest = ~accepted
+        if rest.any():
+            # all candidate/reference pairs at once: |a - b|^2 = |a|^2 - 2ab + |b|^2
+            candidates = encodings[rest]
+            squared = (
+                (candidates**2).sum(axis=1)[:, None]
+                - 2 * candidates @ self.matrix.T
+                + (self.matrix**2).sum(axis=1)[None, :]
+            )
+            accepted[rest] = (squared <= tolerance**2).any(axis=1)
+        return accepted
+
+
+class PrototypeRegistry:
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._prototypes: OrderedDict[int, UserPrototype] = OrderedDict()
+
+    def get(self, user_id: int) -> UserPrototype | None:
+        prototype = self._prototypes.get(user_id)
+        if prototype is None:
+            return None
+        # other workers may have confirmed photos of this user meanwhile
+        if time.monotonic() - prototype.loaded_at > self.ttl:
+            del self._prototypes[user_id]
+            return None
+        self._prototypes.move_to_end(user_id)
+        return prototype
+
+    def set(self, user_id: int, prototype: UserPrototype):
+        self._prototypes[user_id] = prototype
+        self._prototypes.move_to_end(user_id)
+        while len(self._prototypes) > self.max_size:
+            self._prototypes.popitem(last=False)
+
+    def add(self, user_id: int, encoding: np.ndarray):
+        prototype = self._prototypes.get(user_id)
+        if prototype is not None:
+            prototype.add(encoding)
+
+    def discard(self, user_id: int):
+        self._prototypes.pop(user_id, None)
@@ -0,0 +1,338 @@
+import asyncio
+from collections import defaultdict
+from typing import Iterable, Sequence
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.timing import record, span
+from app.db import models
+from app.db.crud import FaceEmbeddingStorage, PhotoStorage
+from app.db.schemas import (
+    FaceBox,
+    FaceCandidate,
+    FaceTag,
+    IdentifiedFace,
+    PhotoConfirmation,
+    PhotoIdentification,
+    User,
+)
+from app.face_id.embedding_store import StoreCursor, embedding_store
+from app.face_id.engine import face_engine
+from app.face_id.index import FaceIndex, face_index
+from app.face_id.prototypes import UserPrototype
+from app.face_id.utils import (
+    FaceAnalysis,
+    analyze_photo,
+    face_prototypes,
+    is_one_person_on_photo,
+)
+
+
+def stored_analysis(faces: Sequence[models.FaceEmbedding]) -> FaceAnalysis:
+    return FaceAnalysis(
+        locations=[(face.top, face.right, face.bottom, face.left) for face in faces],
+        encodings=[face.vector for face in faces],
+    )
+
+
+async def get_photo_analysis(
+    session: AsyncSession, photo: models.Photo
+) -> FaceAnalysis:
+    if photo.face_count is not None:
+        faces = await FaceEmbeddingStorage.get_photo_faces(session, photo.id)
+        if len(faces) == photo.face_count:
+            return stored_analysis(faces)
+    analysis = await run_analysis(photo)
+    await FaceEmbeddingStorage.create_photo_faces(session, photo, analysis.faces)
+    return analysis
+
+
+async def run_analysis(photo: models.Photo) -> FaceAnalysis:
+    # includes waiting for a free worker, the stages below are worker time only
+    with span("face_engine"):
+        analysis = await face_engine.run(analyze_photo, str(photo.file))
+    for stage, seconds in (analysis.timings or {}).items():
+        record(stage, seconds)
+    return analysis
+
+
+async def get_photos_analyses(
+    session: AsyncSession, photos: Sequence[models.Photo]
+) -> dict[int, FaceAnalysis | Exception]:
+    faces = await FaceEmbeddingStorage.get_photos_faces(
+        session, [photo.id for photo in photos]
+    )
+    photo_faces = defaultdict(list)
+    for face in faces:
+        photo_faces[face.photo_id].append(face)
+    analyses: dict[int, FaceAnalysis | Exception] = {}
+    missing = []
+    for photo in photos:
+        if photo.face_count is not None and (
+            len(photo_faces[photo.id]) == photo.face_count
+        ):
+            analyses[photo.id] = stored_analysis(photo_faces[photo.id])
+        else:
+            missing.append(photo)
+    # the session is not shared with the pool, all photos are analysed at once
+    results = await asyncio.gather(
+        *(run_analysis(photo) for photo in missing),
+        return_exceptions=True,
+    )
+    for photo, analysis in zip(missing, results):
+        if not isinstance(analysis, Exception):
+            await FaceEmbeddingStorage.create_photo_faces(
+                session, photo, analysis.faces
+            )
+        analyses[photo.id] = analysis
+    return analyses
+
+
+async def get_reference_encodings(
+    session: AsyncSession, user: User
+) -> list[np.ndarray]:
+    rows = await FaceEmbeddingStorage.get_single_owner_encodings(session, user)
+    known_faces = [
+        np.frombuffer(encoding, dtype=np.float64)
+        for _, encoding in rows
+        if encoding is not None
+    ]
+    for photo_id in {photo_id for photo_id, encoding in rows if encoding is None}:
+        photo = await PhotoStorage.get_photo(session, photo_id)
+        known_faces.extend((await get_photo_analysis(session, photo)).encodings[:1])
+    return known_faces
+
+
+async def get_user_prototype(session: AsyncSession, user: User) -> UserPrototype:
+    prototype = face_prototypes.get(user.id)
+    if prototype is None:
+        prototype = UserPrototype(await get_reference_encodings(session, user))
+        face_prototypes.set(user.id, prototype)
+    return prototype
+
+
+async def confirm_user_photos(
+    session: AsyncSession, user: User, photo_ids: Sequence[int]
+) -> list[PhotoConfirmation]:
+    photos = await PhotoStorage.get_user_photos_by_ids(session, user, photo_ids)
+    linked = await PhotoStorage.get_linked_photo_ids(session, user.id, photo_ids)
+    photos = [photo for photo in photos if photo.id not in linked]
+    analyses = await get_photos_analyses(session, photos)
+
+    reasons: dict[int, str] = {photo_id: "photo not found" for photo_id in photo_ids}
+    reasons.update((photo_id, "already confirmed") for photo_id in linked)
+    candidates = []
+    for photo in photos:
+        analysis = analyses[photo.id]
+        if isinstance(analysis, Exception):
+            reasons[photo.id] = "face analysis failed"
+        elif not await is_one_person_on_photo(analysis):
+            reasons[photo.id] = "On photo have to one person"
+        else:
+            candidates.append((photo, analysis.encodings[0]))
+
+    accepted = []
+    if candidates:
+        person = await get_user_prototype(session, user)
+        encodings = np.asarray([encoding for _, encoding in candidates])
+        # nothing confirmed yet, the first candidate defines the person
+        reference = person if person.size else UserPrototype(encodings[:1])
+        with span("compare"):
+            matches = reference.verify_many(
+                encodings,
+                tolerance=settings.FACE_TOLERANCE,
+                centroid_first=settings.FACE_CENTROID_FAST_PATH,
+            )
+        for (photo, encoding), is_match in zip(candidates, matches):
+            if is_match:
+                accepted.append((photo, encoding))
+            else:
+                reasons[photo.id] = (
+                    f"The person on this photo not the user: {user.email}"
+                )
+
+    await PhotoStorage.link_users(
+        session, [(user.id, photo.id) for photo, _ in accepted]
+    )
+    await session.commit()
+    for photo, encoding in accepted:
+        reasons.pop(photo.id)
+        face_prototypes.add(user.id, encoding)
+    if accepted:
+        faces = await FaceEmbeddingStorage.get_photos_faces(
+            session, [photo.id for photo, _ in accepted]
+        )
+        await index_faces(user.id, faces)
+    return [
+        PhotoConfirmation(
+            photo_id=photo_id,
+            accepted=photo_id not in reasons,
+            reason=reasons.get(photo_id),
+        )
+        for photo_id in photo_ids
+    ]
+
+
+store_cursor = StoreCursor()
+
+
+async def load_confirmed_faces(
+    session: AsyncSession,
+) -> tuple[list[int], list[int], list[np.ndarray]]:
+    rows = await FaceEmbeddingStorage.get_confirmed_faces(session)
+    return (
+        [face_id for face_id, _, _ in rows],
+        [user_id for _, user_id, _ in rows],
+        [np.frombuffer(encoding, dtype=np.float64) for *_, encoding in rows],
+    )
+
+
+async def get_face_index(session: AsyncSession) -> FaceIndex:
+    if not settings.FACE_EMBEDDING_STORE_ENABLED:
+        if not face_index.is_loaded:
+            async with face_index.lock:
+                if not face_index.is_loaded:
+                    face_index.build(*await load_confirmed_faces(session))
+        return face_index
+
+    async with face_index.lock:
+        # other workers append to the same store, pick up what they wrote
+        changed = await asyncio.to_thread(embedding_store.refresh)
+        if not embedding_store.exists:
+            faces = await load_confirmed_faces(session)
+            await asyncio.to_thread(embedding_store.rebuild, *faces)
+            changed = True
+        elif embedding_store.needs_compaction():
+            # tombstones of all workers are compacted here, under the lock
+            await asyncio.to_thread(embedding_store.compact)
+            changed = True
+        if changed or not face_index.is_loaded:
+            store_cursor.apply(embedding_store, face_index)
+    return face_index
+
+
+async def index_faces(user_id: int, faces: Sequence[models.FaceEmbedding]):
+    if settings.FACE_EMBEDDING_STORE_ENABLED:
+        # picked up by get_face_index of every worker
+        if embedding_store.exists:
+            await asyncio.to_thread(
+                embedding_store.append,
+                [face.id for face in faces],
+                [user_id] * len(faces),
+                [face.vector for face in faces],
+            )
+    elif face_index.is_loaded:
+        for face in faces:
+            face_index.add(face.id, user_id, face.vector)
+
+
+async def unindex_faces(face_ids: Sequence[int]):
+    if not settings.FACE_EMBEDDING_STORE_ENABLED:
+        for face_id in face_ids:
+            face_index.remove(face_id)
+        return
+    # picked up and compacted by get_face_index
+    if face_ids and embedding_store.exists:
+        await asyncio.to_thread(embedding_store.delete, face_ids)
+
+
+async def identify_photo(
+    session: AsyncSession, photo: models.Photo, top_k: int
+) -> PhotoIdentification:
+    analysis = await get_photo_analysis(session, photo)
+    index = await get_face_index(session)
+    # several neighbours usually belong to the same user, over-fetch
+    with span("compare"):
+        neighbours = index.search(
+            np.asarray(analysis.encodings),
+            k=top_k * 4,
+            max_distance=settings.FACE_TOLERANCE,
+        )
+    faces = []
+    for (top, right, bottom, left), face_neighbours in zip(
+        analysis.locations, neighbours
+    ):
+        distances: dict[int, float] = {}
+        for neighbour in face_neighbours:
+            distances.setdefault(neighbour.label, neighbour.distance)
+        faces.append(
+            IdentifiedFace(
+                box=FaceBox(top=top, right=right, bottom=bottom, left=left),
+                candidates=[
+                    FaceCandidate(user_id=user_id, distance=distance)
+                    for user_id, distance in list(distances.items())[:top_k]
+                ],
+            )
+        )
+    return PhotoIdentification(photo_id=photo.id, faces=faces)
+
+
+async def auto_tag_photo(
+    session: AsyncSession, photo: models.Photo
+) -> list[tuple[int, int, float]]:
+    faces = await FaceEmbeddingStorage.get_photo_faces(session, photo.id)
+    if not faces:
+        return []
+    index = await get_face_index(session)
+    # one distance computation for all faces of the photo, top-k per face
+    with span("auto_tag"):
+        neighbours = index.search(
+            np.asarray([face.vector for face in faces]),
+            k=settings.AUTO_TAG_TOP_K,
+            max_distance=settings.AUTO_TAG_TOLERANCE,
+        )
+    # closest pairs first, a face gets one user and a user one face
+    suggestions = []
+    tagged_faces, tagged_users = set(), set()
+    for distance, face_id, user_id in sorted(
+        (neighbour.distance, face.id, neighbour.label)
+        for face, face_neighbours in zip(faces, neighbours)
+        for neighbour in face_neighbours
+    ):
+        if face_id not in tagged_faces and user_id not in tagged_users:
+            tagged_faces.add(face_id)
+            tagged_users.add(user_id)
+            suggestions.append((face_id, user_id, distance))
+    await FaceEmbeddingStorage.set_suggestions(session, suggestions)
+    if settings.AUTO_TAG_MODE == "write":
+        await link_users_to_photo(session, photo, faces, tagged_users)
+    else:
+        await session.commit()
+    return suggestions
+
+
+async def link_users_to_photo(
+    session: AsyncSession,
+    photo: models.Photo,
+    faces: Sequence[models.FaceEmbedding],
+    user_ids: Iterable[int],
+) -> list[int]:
+    linked = await PhotoStorage.get_photo_user_ids(session, photo.id)
+    added = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in linked]
+    await PhotoStorage.link_users(session, [(user_id, photo.id) for user_id in added])
+    await session.commit()
+    # the same rule as get_confirmed_faces: one-face photos become references
+    if photo.face_count == 1:
+        for user_id in added:
+            face_prototypes.discard(user_id)
+            await index_faces(user_id, faces)
+    return added
+
+
+async def photo_face_tags(session: AsyncSession, photo_id: int) -> list[FaceTag]:
+    linked = await PhotoStorage.get_photo_user_ids(session, photo_id)
+    return [
+        FaceTag(
+            face_id=face.id,
+            user_id=face.suggested_user_id,
+            distance=face.suggested_distance,
+            box=FaceBox(
+                top=face.top, right=face.right, bottom=face.bottom, left=face.left
+            ),
+            linked=face.suggested_user_id in linked,
+        )
+        for face in await FaceEmbeddingStorage.get_photo_faces(session, photo_id)
+        if face.suggested_user_id is not None
+    ]
@@ -1,26 +1,114 @@
-from typing import Sequence
+import time
+from typing import NamedTuple
 
-import face_recognition
+import numpy as np
+from PIL import Image, ImageOps
 
-from app.db.models import Photo
+from app.core.config import settings
+from app.core.timing import span
+from app.face_id.prototypes import PrototypeRegistry, UserPrototype
 
 
-async def is_one_person_on_photo(photo: Photo):
-    img = face_recognition.load_image_file(photo.file)
+class DetectedFace(NamedTuple):
+    location: tuple[int, int, int, int]
+    encoding: np.ndarray
+
+
+class FaceAnalysis(NamedTuple):
+    locations: list[tuple[int, int, int, int]]
+    encodings: list[np.ndarray]
+    # the decoded image stays in the worker unless explicitly asked for
+    image: np.ndarray | None = None
+    # seconds per stage, measured in the worker and recorded by the caller
+    timings: dict[str, float] | None = None
+
+    @property
+    def faces(self) -> list[DetectedFace]:
+        return [
+            DetectedFace(location=location, encoding=encoding)
+            for location, encoding in zip(self.locations, self.encodings)
+        ]
+
+
+# returns the RGB array fitted into max_side pixels and the factor mapping
+# its coordinates back to the full resolution image
+def load_image(path: str, max_side: int = 0) -> tuple[np.ndarray, float]:
+    with Image.open(path) as image:
+        full_side = max(image.size)
+        if max_side and full_side > max_side:
+            ratio = max_side / full_side
+            # JPEGs are decoded straight at 1/2, 1/4 or 1/8 scale
+            image.draft("RGB", (int(image.width * ratio), int(image.height * ratio)))
+            image.thumbnail((max_side, max_side))
+        # phone cameras store rotation in EXIF instead of rotating the pixels
+        image = ImageOps.exif_transpose(image)
+        return np.array(image.convert("RGB")), full_side / max(image.size)
+
+
+def remap_locations(
+    locations: list[tuple[int, int, int, int]], scale: float, shape: tuple
+) -> list[tuple[int, int, int, int]]:
+    height, width = shape[:2]
+    return [
+        (
+            max(round(top * scale), 0),
+            min(round(right * scale), width),
+            min(round(bottom * scale), height),
+            max(round(left * scale), 0),
+        )
+        for top, right, bottom, left in locations
+    ]
+
+
+def analyze_photo(
+    path: str, keep_image: bool = False, detection_max_side: int | None = None
+) -> FaceAnalysis:
+    # imported here, in the face engine worker, the API process never loads dlib
+    import face_recognition
+
+    if detection_max_side is None:
+        detection_max_side = settings.FACE_DETECTION_MAX_SIDE
+    timings = {}
+    start = time.perf_counter()
+    img, scale = load_image(path, detection_max_side)
+    timings["decode"] = time.perf_counter() - start
+
+    start = time.perf_counter()
     face_locations = face_recognition.face_locations(img)
-    return len(face_locations) == 1
+    timings["detect"] = time.perf_counter() - start
+
+    # encode on the full resolution image, only decoded if there is a face
+    if scale != 1 and (face_locations or keep_image):
+        start = time.perf_counter()
+        img, _ = load_image(path)
+        face_locations = remap_locations(face_locations, scale, img.shape)
+        timings["decode"] += time.perf_counter() - start
+
+    start = time.perf_counter()
+    encodings = face_recognition.face_encodings(img, face_locations)
+    timings["encode"] = time.perf_counter() - start
+    return FaceAnalysis(
+        locations=face_locations,
+        encodings=encodings,
+        image=img if keep_image else None,
+        timings=timings,
+    )
+
+
+async def is_one_person_on_photo(analysis: FaceAnalysis):
+    return len(analysis.locations) == 1
 
 
-async def is_person_same(photos_of_person: Sequence[Photo], unknown_person: Photo):
-    known_images = []
-    for photo in photos_of_person:
-        known_images.append(face_recognition.load_image_file(photo.file))
-    unknown_image = face_recognition.load_image_file(unknown_person.file)
+async def is_person_same(person: UserPrototype, unknown_person: FaceAnalysis):
+    with span("compare"):
+        return person.verify(
+            unknown_person.encodings[0],
+            tolerance=settings.FACE_TOLERANCE,
+            centroid_first=settings.FACE_CENTROID_FAST_PATH,
+        )
 
-    known_faces = []
-    for known_image in known_images:
-        known_faces.append(face_recognition.face_encodings(known_image)[0])
-    unknown_face = face_recognition.face_encodings(unknown_image)[0]
 
-    result = face_recognition.compare_faces(known_faces, unknown_face)
-    return any(result)
+face_prototypes = PrototypeRegistry(
+    max_size=settings.FACE_PROTOTYPE_CACHE_SIZE,
+    ttl=settings.FACE_PROTOTYPE_TTL_SECONDS,
+)
@@ -1,8 +1,37 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
 from app.api.main import api_router
+from app.api.routes import metrics
 from app.core.config import settings
+from app.core.timing import TimingMiddleware
+from app.db.blob_collector import blob_collector
+from app.face_id.clustering import face_clusterer
+from app.face_id.engine import face_engine
+from app.face_id.pipeline import ingestion_pipeline
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    face_engine.start()
+    # otherwise the first face request of a worker pays for loading the models
+    if settings.FACE_WARMUP:
+        await face_engine.warmup()
+    await ingestion_pipeline.start()
+    await blob_collector.start()
+    await face_clusterer.start()
+    yield
+    await face_clusterer.shutdown()
+    await blob_collector.shutdown()
+    await ingestion_pipeline.shutdown()
+    await face_engine.shutdown()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(TimingMiddleware)
 
 app.include_router(api_router, prefix=settings.API_V1_STR)
+# scraped at the root like any other Prometheus target
+if settings.METRICS_ENABLED:
+    app.include_router(metrics.router, tags=["metrics"])
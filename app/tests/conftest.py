@@ -1,18 +1,23 @@
 import asyncio
 import time
+from contextlib import contextmanager
 
 import pytest
 from httpx import AsyncClient
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 
 from app.core.config import settings
 from app.db.database import Base, get_db_session
+from app.db.instrumentation import InstrumentedPool, instrument_engine
+from app.face_id.embedding_store import embedding_store
 from app.main import app
 
 SQLALCHEMY_DATABASE_URL = f"postgresql+psycopg://{settings.POSTGRESQL_USERNAME}:{settings.POSTGRESQL_PASSWORD}@{settings.POSTGRESQL_HOSTNAME}:{settings.POSTGRESQL_PORT}/hr_test_db"
 
 # engine = create_async_engine("sqlite+aiosqlite:///./test_db.sqlite")
-engine = create_async_engine(SQLALCHEMY_DATABASE_URL)
+engine = create_async_engine(SQLALCHEMY_DATABASE_URL, poolclass=InstrumentedPool)
+instrument_engine(engine)
 async_session = async_sessionmaker(engine, expire_on_commit=False)
 
 
@@ -23,6 +28,13 @@ async def set_up_db():
 
 
 asyncio.run(set_up_db())
+# derived from the database that was just recreated
+embedding_store.clear()
+
+
+@pytest.fixture
+def session_factory():
+    return async_session
 
 
 @pytest.fixture
@@ -39,3 +51,22 @@ async def client(session):
     app.dependency_overrides[get_db_session] = override_get_db
     yield AsyncClient(app=app, base_url="http://testserver")
     del app.dependency_overrides[get_db_session]
+
+
+@pytest.fixture
+def assert_max_queries():
+    @contextmanager
+    def counter(budget: int):
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine.sync_engine, "before_cursor_execute", count)
+        try:
+            yield statements
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", count)
+        assert len(statements) <= budget, "\n\n".join(statements)
+
+    return counter
@@ -1,19 +1,38 @@
+import asyncio
 import io
-from datetime import timedelta
+import os
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
 from typing import NamedTuple
 
+import numpy as np
 import pytest
 import pytest_asyncio
 from faker import Faker
 from fastapi import UploadFile
 from fastapi.security import OAuth2PasswordRequestForm
+from passlib.context import CryptContext
 from PIL import Image
+from sqlalchemy.exc import StatementError
 
+from app.api import serialization
 from app.core.config import settings
-from app.db.models import Album, Photo, User
-from app.db.schemas import Token
+from app.db.blob_collector import blob_collector
+from app.db.crud import (
+    BlobStorage,
+    FaceClusterStorage,
+    FaceEmbeddingStorage,
+    PhotoStorage,
+)
+from app.db.database import storage
+from app.db.models import Album, Blob, FaceEmbedding, Photo, User
+from app.db.schemas import PhotoCreate, Token
+from app.face_id.clustering import FaceClusterer
+from app.face_id.embedding_store import embedding_store
+from app.face_id.index import face_index
+from app.face_id.pipeline import ingestion_pipeline
 from app.main import app
-from app.utils import create_access_token, get_password_hash
+from app.utils import create_access_token, get_password_hash, pwd_context
 
 faker = Faker()
 
@@ -68,6 +87,56 @@ async def test_get_all_users(client, user: UserRawPassword):
     assert response.status_code == 200 and user.id == response.json()[0]["id"]
 
 
+async def test_get_all_users_by_cursor(client, session):
+    session.add_all(
+        [User(email=faker.email(), hashed_password="hash") for _ in range(3)]
+    )
+    await session.commit()
+
+    first_page = await client.get(
+        app.url_path_for("get_all_users"), params={"limit": 2}
+    )
+    cursor = first_page.headers["X-Next-Cursor"]
+    second_page = await client.get(
+        app.url_path_for("get_all_users"), params={"limit": 2, "cursor": cursor}
+    )
+    offset_page = await client.get(
+        app.url_path_for("get_all_users"), params={"limit": 2, "offset": 2}
+    )
+
+    assert first_page.status_code == 200 and second_page.status_code == 200
+    assert second_page.json() == offset_page.json()
+    assert first_page.json()[-1]["id"] < second_page.json()[0]["id"]
+
+
+async def test_metrics(client, user: UserRawPassword):
+    await client.get(app.url_path_for("get_all_users"))
+
+    response = await client.get(app.url_path_for("get_metrics"))
+    text = response.text
+
+    assert response.status_code == 200
+    assert 'db_statement_seconds_count{operation="SELECT"}' in text
+    assert 'db_pool_wait_seconds_bucket{le="+Inf"}' in text
+    assert "db_pool_checked_out 1" in text
+
+
+async def test_server_timing(monkeypatch, client, user: UserRawPassword):
+    response = await client.get(app.url_path_for("get_all_users"))
+    assert "server-timing" not in response.headers
+
+    monkeypatch.setattr(settings, "SERVER_TIMING_ENABLED", True)
+    response = await client.get(app.url_path_for("get_all_users"))
+    metrics_text = (await client.get(app.url_path_for("get_metrics"))).text
+
+    assert response.headers["server-timing"].startswith("db;dur=")
+    assert "total;dur=" in response.headers["server-timing"]
+    assert (
+        'http_request_seconds_count{method="GET",route="/api/v1/users/",status="200"}'
+        in metrics_text
+    )
+
+
 class TestUsersApi:
     async def test_create_user(self, client):
         email = faker.email()
@@ -96,6 +165,21 @@ class TestUsersApi:
             and data["id"] == user.id
         )
 
+    async def test_get_user_after_deactivation(
+        self, session, client, user: UserRawPassword, token: Token
+    ):
+        headers = {"Authorization": f"Bearer {token.access_token}"}
+        response = await client.get(app.url_path_for("get_me"), headers=headers)
+        assert response.status_code == 200
+
+        db_user = await session.get(User, user.id)
+        db_user.is_active = False
+        await session.commit()
+        session.expunge(db_user)
+
+        response = await client.get(app.url_path_for("get_me"), headers=headers)
+        assert response.status_code == 400
+
 
 class TestAlbumApi:
 
@@ -112,6 +196,70 @@ class TestAlbumApi:
 
         assert response.status_code == 200 and isinstance(data, list) and len(data) == 1
 
+    @pytest_asyncio.fixture
+    async def album_with_photos(self, session, album: Album, user: UserRawPassword):
+        photos = [
+            Photo(
+                title=faker.name(),
+                description=faker.text(),
+                uploaded_by_id=user.id,
+                album_id=album.id,
+            )
+            for _ in range(5)
+        ]
+        session.add_all(photos)
+        await session.commit()
+        await PhotoStorage.link_users(
+            session, [(user.id, photo.id) for photo in photos]
+        )
+        await session.commit()
+        session.expunge_all()
+        return album
+
+    async def test_album_reads_query_budget(
+        self, client, assert_max_queries, album_with_photos: Album
+    ):
+        with assert_max_queries(3):
+            response = await client.get(
+                app.url_path_for("get_album_by_id", album_id=album_with_photos.id)
+            )
+        with assert_max_queries(3):
+            list_response = await client.get(
+                app.url_path_for("get_user_albums_by_id"),
+                params={"user_id": album_with_photos.owner_id},
+            )
+
+        photos = response.json()["photos"]
+        assert response.status_code == 200 and len(photos) == 5
+        assert all(len(photo["users"]) == 1 for photo in photos)
+        assert list_response.json()[0] == response.json()
+
+    async def test_album_conditional_get(
+        self, session, client, assert_max_queries, album_with_photos: Album
+    ):
+        url = app.url_path_for("get_album_by_id", album_id=album_with_photos.id)
+        response = await client.get(url)
+        etag = response.headers["etag"]
+
+        # one aggregate query instead of the album, photos and users
+        with assert_max_queries(1):
+            cached = await client.get(url, headers={"If-None-Match": etag})
+        assert cached.status_code == 304 and cached.headers["etag"] == etag
+
+        other = User(email=faker.email(), hashed_password="hash")
+        session.add(other)
+        await session.commit()
+        photo_id = response.json()["photos"][0]["id"]
+        await PhotoStorage.link_users(session, [(other.id, photo_id)])
+        await session.commit()
+        # the client shares this session, drop the photos loaded above
+        session.expunge_all()
+
+        response = await client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 200 and response.headers["etag"] != etag
+        [photo] = [p for p in response.json()["photos"] if p["id"] == photo_id]
+        assert len(photo["users"]) == 2
+
     async def test_create_album(self, client, user: UserRawPassword, token: Token):
         title = faker.name()
         description = faker.text()
@@ -189,6 +337,20 @@ class TestLoginApi:
         token: Token = response.json()
         assert "access_token" in token
 
+    async def test_login_rehashes_outdated_password_hash(
+        self, session, client, user: UserRawPassword
+    ):
+        db_user = await session.get(User, user.id)
+        outdated_context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4)
+        db_user.hashed_password = outdated_context.hash(user.password)
+        await session.commit()
+
+        response = await client.post(app.url_path_for("login_for_access_token"))
+        await session.refresh(db_user)
+
+        assert response.status_code == 200
+        assert not pwd_context.needs_update(db_user.hashed_password)
+
 
 class TestPhotoApi:
     @pytest.fixture
@@ -207,16 +369,8 @@ class TestPhotoApi:
             filename=title,
             file=binary_image,
         )
-        photo = Photo(
-            title=title,
-            description=faker.text(),
-            uploaded_by_id=user.id,
-            file=file,
-        )
-        session.add(photo)
-        await session.commit()
-        await session.refresh(photo)
-        return photo
+        photo = PhotoCreate(title=title, description=faker.text(), file=file)
+        return await PhotoStorage.create_photo(session, photo, user)
 
     async def test_create_photo(self, client, token: Token, binary_image):
         multipart_form_data = {
@@ -235,14 +389,211 @@ class TestPhotoApi:
             and response.json().get("title") == multipart_form_data["title"][-1]
         )
 
-    async def test_get_user_photos(self, client, token: Token):
+    async def test_duplicate_uploads_share_one_file(
+        self, monkeypatch, session, session_factory, client, token: Token
+    ):
+        image = io.BytesIO()
+        Image.new("RGB", (64, 64), color=(10, 20, 30)).save(image, format="PNG")
+        files = [("files", (name, image.getvalue())) for name in ("a.png", "b.PNG")]
+        headers = {"Authorization": f"Bearer {token.access_token}"}
+
+        response = await client.post(
+            app.url_path_for("add_photos_to_current_user"), files=files, headers=headers
+        )
+        first, second = response.json()
+        key = first["file"].removeprefix(str(settings.photo_dir) + "/")
+        blob = await session.get(Blob, key)
+
+        assert first["file"] == second["file"] and os.path.exists(first["file"])
+        assert key.count("/") == 2 and key.endswith(".png") and blob.refcount == 2
+        # the second copy was staged and dropped
+        assert not list(Path(settings.photo_dir).glob("*.part"))
+
+        for result in (first, second):
+            await client.delete(
+                app.url_path_for("delete_photo_by_id", photo_id=result["id"]),
+                headers=headers,
+            )
+        await session.refresh(blob)
+        assert blob.refcount == 0 and os.path.exists(first["file"])
+
+        monkeypatch.setattr(blob_collector, "session_factory", session_factory)
+        monkeypatch.setattr(blob_collector, "grace", -60)
+        assert await blob_collector.collect() >= 1
+        assert not os.path.exists(first["file"])
+
+    async def test_upload_needs_a_blob_ref(
+        self, session, user: UserRawPassword, binary_image
+    ):
+        session.add(
+            Photo(
+                title="unreferenced",
+                description="",
+                uploaded_by_id=user.id,
+                file=UploadFile(filename="unreferenced.png", file=binary_image),
+            )
+        )
+        with pytest.raises(StatementError):
+            await session.flush()
+        await session.rollback()
+
+    async def test_upload_waits_for_collected_file(
+        self, session, session_factory, client, token: Token
+    ):
+        image = io.BytesIO()
+        Image.new("RGB", (64, 64), color=(40, 50, 60)).save(image, format="PNG")
+        key = storage.store(image, "race.png")
+        session.add(
+            Blob(
+                key=key,
+                refcount=0,
+                updated_at=datetime(2000, 1, 1, tzinfo=timezone.utc),
+            )
+        )
+        await session.commit()
+
+        # the collector has deleted the row but not yet the file when the
+        # same content is uploaded, the upload finds the file and waits
+        async with session_factory() as collector_session:
+            cutoff = datetime.now(timezone.utc)
+            assert await BlobStorage.collect_garbage(collector_session, cutoff) == [key]
+            upload = asyncio.create_task(
+                client.post(
+                    app.url_path_for("add_photos_to_current_user"),
+                    files=[("files", ("race.png", image.getvalue()))],
+                    headers={"Authorization": f"Bearer {token.access_token}"},
+                )
+            )
+            await asyncio.sleep(0.5)
+            storage.delete(key)
+            await collector_session.commit()
+        response = await upload
+
+        [result] = response.json()
+        assert os.path.exists(result["file"])
+        blob = await session.get(Blob, key, populate_existing=True)
+        assert blob.refcount == 1
+
+    async def test_create_photos_batch(
+        self, session, client, user: UserRawPassword, token: Token, binary_image
+    ):
+        binary_image.seek(0)
+        images = binary_image.read()
+        files = [
+            ("files", ("first.png", images)),
+            ("files", ("broken.png", b"not an image")),
+            ("files", ("second.png", images)),
+        ]
+        response = await client.post(
+            app.url_path_for("add_photos_to_current_user"),
+            files=files,
+            headers={"Authorization": f"Bearer {token.access_token}"},
+        )
+        results = response.json()
+        first, broken, second = results
+
+        assert response.status_code == 200 and len(results) == 3
+        assert [result["filename"] for result in results] == [
+            "first.png",
+            "broken.png",
+            "second.png",
+        ]
+        assert broken["id"] is None and broken["error"] == "Invalid image file"
+        assert first["id"] < second["id"]
+        for result in (first, second):
+            photo = await session.get(Photo, result["id"])
+            assert photo.uploaded_by_id == user.id and photo.title == result["filename"]
+            assert photo.file is not None and result["processing_status"] == "pending"
+
+    async def test_get_user_photos(self, client, token: Token, assert_max_queries):
+        # user, photos and the users on them
+        with assert_max_queries(3):
+            response = await client.get(
+                app.url_path_for("read_current_user_photos"),
+                headers={"Authorization": f"Bearer {token.access_token}"},
+                params={"skip": 0, "limit": 100},
+            )
+
+        assert response.status_code == 200 and len(response.json()) == 1
+
+    @pytest.mark.parametrize("encoder", ["orjson", "json"])
+    async def test_photo_list_matches_photo_read(
+        self, monkeypatch, session, client, user: UserRawPassword, token: Token, encoder
+    ):
+        if encoder == "json":
+            monkeypatch.setattr(serialization, "orjson", None)
+        photo = await self.add_photo(session, user)
+        await PhotoStorage.link_users(session, [(user.id, photo.id)])
+        await session.commit()
+        session.expunge_all()
+
         response = await client.get(
             app.url_path_for("read_current_user_photos"),
             headers={"Authorization": f"Bearer {token.access_token}"},
-            params={"skip": 0, "limit": 100},
         )
+        # the list is rendered from rows, the single read through the schema
+        single = await client.get(
+            app.url_path_for("get_photo_by_id", photo_id=photo.id)
+        )
+        [listed] = [p for p in response.json() if p["id"] == photo.id]
+        assert listed == single.json() and listed["file"] and listed["users"]
 
-        assert response.status_code == 200 and len(response.json()) == 1
+    async def test_get_user_photos_conditional(
+        self, session, client, user: UserRawPassword, token: Token, photo_in_db: Photo
+    ):
+        url = app.url_path_for("read_current_user_photos")
+        headers = {"Authorization": f"Bearer {token.access_token}"}
+        etag = (await client.get(url, headers=headers)).headers["etag"]
+
+        response = await client.get(url, headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 304
+
+        await PhotoStorage.link_users(session, [(user.id, photo_in_db.id)])
+        await session.commit()
+        session.expunge_all()
+        response = await client.get(url, headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 200 and response.json()[0]["users"]
+
+    async def test_get_photo_file(
+        self,
+        session,
+        client,
+        user: UserRawPassword,
+        token: Token,
+        binary_image: io.BytesIO,
+    ):
+        photo = await self.add_photo(session, user)
+        url = app.url_path_for("get_photo_file", photo_id=photo.id)
+        headers = {"Authorization": f"Bearer {token.access_token}"}
+
+        response = await client.get(url, headers=headers)
+        assert response.content == binary_image.getvalue()
+        assert "immutable" in response.headers["cache-control"]
+
+        response = await client.get(
+            url, headers={**headers, "If-None-Match": response.headers["etag"]}
+        )
+        assert response.status_code == 304 and not response.content
+
+    async def test_get_photo_file_of_other_user(
+        self, session, client, user: UserRawPassword
+    ):
+        photo = await self.add_photo(session, user)
+        url = app.url_path_for("get_photo_file", photo_id=photo.id)
+        other = User(email=faker.email(), hashed_password="hash")
+        other_token = await create_access_token(data={"sub": other.email})
+        session.add(other)
+        await session.commit()
+        headers = {"Authorization": f"Bearer {other_token}"}
+
+        assert (await client.get(url)).status_code == 401
+        assert (await client.get(url, headers=headers)).status_code == 403
+
+        # a person tagged on the photo may see it
+        await PhotoStorage.link_users(session, [(other.id, photo.id)])
+        await session.commit()
+        session.expunge_all()
+        assert (await client.get(url, headers=headers)).status_code == 200
 
     async def test_delete_photo(
         self, session, client, token: Token, photo_in_db: Photo
@@ -275,3 +626,368 @@ class TestPhotoApi:
             and photo.album_id == album.id
             and response.json().get("id") == photo_in_db.id
         )
+
+    async def test_album_version_follows_membership(
+        self, session, user: UserRawPassword, album: Album
+    ):
+        other = Album(title=faker.name(), description="", owner_id=user.id)
+        session.add(other)
+        photo = await self.add_photo(session, user)
+        versions = {album.id: album.version, other.id: 1}
+
+        await PhotoStorage.change_photo_album(session, photo, album)
+        await PhotoStorage.change_photo_album(session, photo, other)
+        await session.refresh(album)
+        await session.refresh(other)
+        assert album.version == versions[album.id] + 2
+        assert other.version == versions[other.id] + 1
+
+        await PhotoStorage.delete_photo(session, photo)
+        await session.refresh(other)
+        assert other.version == versions[other.id] + 2
+
+    @staticmethod
+    async def store_face(session, photo: Photo, encoding: np.ndarray):
+        session.add(
+            FaceEmbedding(
+                photo_id=photo.id,
+                face_index=0,
+                top=0,
+                right=10,
+                bottom=10,
+                left=0,
+                encoding=encoding.tobytes(),
+                model_version=settings.FACE_MODEL_VERSION,
+            )
+        )
+        photo.face_count = 1
+        await session.commit()
+
+    @staticmethod
+    async def add_photo(session, user: UserRawPassword):
+        img = io.BytesIO()
+        Image.new("RGB", (100, 100)).save(img, format="PNG")
+        img.seek(0)
+        photo = PhotoCreate(
+            title=faker.file_name(category="image"),
+            description=faker.text(),
+            file=UploadFile(filename=faker.file_name(category="image"), file=img),
+        )
+        return await PhotoStorage.create_photo(session, photo, user)
+
+    @pytest_asyncio.fixture
+    async def reference_photo(self, session, user: UserRawPassword):
+        photo = await self.add_photo(session, user)
+        await PhotoStorage.link_users(session, [(user.id, photo.id)])
+        await session.commit()
+        return photo
+
+    async def test_get_single_owner_photos(
+        self, session, client, user: UserRawPassword, token: Token
+    ):
+        other = User(email=faker.email(), hashed_password="hash")
+        session.add(other)
+        alone, together = [await self.add_photo(session, user) for _ in range(2)]
+        await PhotoStorage.link_users(
+            session,
+            [(user.id, alone.id), (user.id, together.id), (other.id, together.id)],
+        )
+        await session.commit()
+        url = app.url_path_for("get_photos_there_only_owner")
+        headers = {"Authorization": f"Bearer {token.access_token}"}
+
+        response = await client.get(url, headers=headers)
+        assert [photo["id"] for photo in response.json()] == [alone.id]
+
+        # a pair that is not linked must not decrement people_count
+        await PhotoStorage.unlink_users(
+            session, [(other.id, together.id), (other.id, alone.id)]
+        )
+        await session.commit()
+        await session.refresh(alone)
+        assert alone.people_count == 1
+        await session.refresh(together)
+
+        response = await client.get(url, headers=headers)
+        assert together.people_count == 1
+        assert {photo["id"] for photo in response.json()} == {alone.id, together.id}
+
+    async def test_set_it_is_me_without_face(
+        self, session, client, user: UserRawPassword, token: Token
+    ):
+        photo = await self.add_photo(session, user)
+
+        response = await client.patch(
+            app.url_path_for("patch_photo_me", photo_id=photo.id),
+            headers={"Authorization": f"Bearer {token.access_token}"},
+        )
+        await session.refresh(photo)
+
+        assert response.status_code == 400 and photo.face_count == 0
+
+    @pytest.mark.parametrize("shift, status_code", [(0.01, 200), (1.0, 400)])
+    async def test_set_it_is_me_uses_stored_faces(
+        self,
+        session,
+        client,
+        token: Token,
+        photo_in_db: Photo,
+        reference_photo: Photo,
+        shift: float,
+        status_code: int,
+    ):
+        encoding = np.random.default_rng(0).normal(0, 0.1, 128)
+        await self.store_face(session, reference_photo, encoding)
+        await self.store_face(session, photo_in_db, encoding + shift)
+
+        response = await client.patch(
+            app.url_path_for("patch_photo_me", photo_id=photo_in_db.id),
+            headers={"Authorization": f"Bearer {token.access_token}"},
+        )
+
+        assert response.status_code == status_code
+
+    async def test_tagged_friend_is_not_a_reference(
+        self,
+        session,
+        client,
+        user: UserRawPassword,
+        token: Token,
+        reference_photo: Photo,
+    ):
+        friend = User(email=faker.email(), hashed_password="hash")
+        session.add(friend)
+        await self.store_face(session, reference_photo, np.full(128, 0.1))
+        encoding = np.random.default_rng(5).normal(0, 0.1, 128)
+        tagged, candidate = [await self.add_photo(session, user) for _ in range(2)]
+        await self.store_face(session, tagged, encoding)
+        await self.store_face(session, candidate, encoding + 0.01)
+        # the uploader tagged the friend, as PATCH /photos/{id}/tags does
+        await PhotoStorage.link_users(session, [(friend.id, tagged.id)])
+        await session.commit()
+        headers = {"Authorization": f"Bearer {token.access_token}"}
+
+        response = await client.get(
+            app.url_path_for("get_photos_there_only_owner"), headers=headers
+        )
+        assert tagged.id not in {photo["id"] for photo in response.json()}
+
+        response = await client.patch(
+            app.url_path_for("patch_photo_me", photo_id=candidate.id),
+            headers=headers,
+        )
+        assert response.status_code == 400
+
+    async def test_set_it_is_me_batch(
+        self,
+        session,
+        client,
+        user: UserRawPassword,
+        token: Token,
+        reference_photo: Photo,
+    ):
+        encoding = np.random.default_rng(2).normal(0, 0.1, 128)
+        await self.store_face(session, reference_photo, encoding)
+        same, other, empty = [await self.add_photo(session, user) for _ in range(3)]
+        await self.store_face(session, same, encoding + 0.01)
+        await self.store_face(session, other, encoding + 1.0)
+        empty.face_count = 0
+        await session.commit()
+        photo_ids = [same.id, other.id, empty.id, reference_photo.id, 0]
+
+        response = await client.patch(
+            app.url_path_for("patch_photos_me"),
+            headers={"Authorization": f"Bearer {token.access_token}"},
+            json=photo_ids,
+        )
+        await session.refresh(same)
+        await session.refresh(other)
+
+        assert response.status_code == 200
+        assert [result["photo_id"] for result in response.json()] == photo_ids
+        assert [result["accepted"] for result in response.json()] == [
+            True,
+            False,
+            False,
+            False,
+            False,
+        ]
+        assert [result["reason"] for result in response.json()[1:]] == [
+            f"The person on this photo not the user: {user.email}",
+            "On photo have to one person",
+            "already confirmed",
+            "photo not found",
+        ]
+        assert same.people_count == 1 and other.people_count == 0
+
+    async def test_face_clusters(
+        self, session, session_factory, client, user: UserRawPassword, token: Token
+    ):
+        encoding = np.random.default_rng(3).normal(0, 0.1, 128)
+        same = [await self.add_photo(session, user) for _ in range(3)]
+        other = await self.add_photo(session, user)
+        for photo in same[:2]:
+            await self.store_face(session, photo, encoding)
+        await self.store_face(session, other, encoding + 1.0)
+        clusterer = FaceClusterer(interval=0, chunk_size=2, tolerance=0.5)
+        clusterer.session_factory = session_factory
+        headers = {"Authorization": f"Bearer {token.access_token}"}
+
+        await clusterer.cluster_owner(user.id)
+        # only the face stored since the last run is clustered
+        await self.store_face(session, same[2], encoding + 0.01)
+        assert await clusterer.cluster_owner(user.id) == 1
+
+        response = await client.get(
+            app.url_path_for("get_face_clusters"), headers=headers
+        )
+        assert response.status_code == 200
+        [cluster] = response.json()
+        assert {face["photo_id"] for face in cluster["faces"]} == {
+            photo.id for photo in same
+        }
+
+        response = await client.patch(
+            app.url_path_for("patch_face_cluster_me", cluster_id=cluster["id"]),
+            headers=headers,
+        )
+        assert [result["accepted"] for result in response.json()] == [True] * 3
+        response = await client.get(
+            app.url_path_for("get_face_clusters"), headers=headers
+        )
+        assert response.json() == []
+
+    async def test_removed_faces_leave_their_cluster(
+        self, session, session_factory, user: UserRawPassword
+    ):
+        encoding = np.random.default_rng(4).normal(0, 0.1, 128)
+        photos = [await self.add_photo(session, user) for _ in range(3)]
+        for i, photo in enumerate(photos):
+            await self.store_face(session, photo, encoding + 0.02 * i)
+        clusterer = FaceClusterer(interval=0, chunk_size=10, tolerance=0.5)
+        clusterer.session_factory = session_factory
+        await clusterer.cluster_owner(user.id)
+
+        async def clusters():
+            async with session_factory() as fresh:
+                return await FaceClusterStorage.get_owner_clusters(fresh, user.id)
+
+        # reprocessing replaces the face with one the clusterer has not seen
+        await FaceEmbeddingStorage.create_photo_faces(
+            session, photos[0], [((0, 10, 10, 0), encoding + 1.0)]
+        )
+        [cluster] = await clusters()
+        assert cluster.size == 2
+        assert np.allclose(cluster.vector, encoding + 0.03)
+
+        await PhotoStorage.delete_photo(session, photos[1])
+        [cluster] = await clusters()
+        assert cluster.size == 1 and np.allclose(cluster.vector, encoding + 0.04)
+
+        await PhotoStorage.delete_photo(session, photos[2])
+        assert await clusters() == []
+
+    async def test_identify_users_on_photo(
+        self,
+        session,
+        client,
+        user: UserRawPassword,
+        token: Token,
+        photo_in_db: Photo,
+        reference_photo: Photo,
+    ):
+        encoding = np.random.default_rng(1).normal(0, 0.1, 128)
+        await self.store_face(session, reference_photo, encoding)
+        await self.store_face(session, photo_in_db, encoding + 0.01)
+        face_index.clear()
+        embedding_store.clear()
+
+        response = await client.post(
+            app.url_path_for("identify_users_on_photo", photo_id=photo_in_db.id),
+            headers={"Authorization": f"Bearer {token.access_token}"},
+        )
+        bulk_response = await client.post(
+            app.url_path_for("identify_users_on_photos"),
+            headers={"Authorization": f"Bearer {token.access_token}"},
+            json=[photo_in_db.id],
+        )
+        candidates = response.json()["faces"][0]["candidates"]
+
+        assert response.status_code == 200 and candidates[0]["user_id"] == user.id
+        assert bulk_response.status_code == 200
+        assert bulk_response.json() == [response.json()]
+
+    async def test_auto_tag_proposals(
+        self,
+        monkeypatch,
+        session,
+        session_factory,
+        client,
+        user: UserRawPassword,
+        token: Token,
+        photo_in_db: Photo,
+        reference_photo: Photo,
+    ):
+        encoding = np.random.default_rng(4).normal(0, 0.1, 128)
+        await self.store_face(session, reference_photo, encoding)
+        await self.store_face(session, photo_in_db, encoding + 0.01)
+        face_index.clear()
+        embedding_store.clear()
+        monkeypatch.setattr(settings, "AUTO_TAG_MODE", "propose")
+        monkeypatch.setattr(ingestion_pipeline, "session_factory", session_factory)
+        url = app.url_path_for("get_photo_tags", photo_id=photo_in_db.id)
+        headers = {"Authorization": f"Bearer {token.access_token}"}
+
+        await ingestion_pipeline.process(photo_in_db.id)
+        response = await client.get(url, headers=headers)
+        [tag] = response.json()
+        assert tag["user_id"] == user.id and not tag["linked"]
+
+        response = await client.patch(url, headers=headers, json=[tag["face_id"]])
+        await session.refresh(photo_in_db)
+        assert response.json()[0]["linked"] and photo_in_db.people_count == 1
+
+    async def test_photo_processing(
+        self,
+        monkeypatch,
+        session,
+        session_factory,
+        client,
+        user: UserRawPassword,
+        token: Token,
+    ):
+        photo = await self.add_photo(session, user)
+        url = app.url_path_for("get_photo_processing", photo_id=photo.id)
+        headers = {"Authorization": f"Bearer {token.access_token}"}
+
+        response = await client.get(url, headers=headers)
+        assert response.status_code == 200
+        assert response.json()["processing_status"] == "pending"
+
+        monkeypatch.setattr(ingestion_pipeline, "session_factory", session_factory)
+        await ingestion_pipeline.process(photo.id)
+        await session.refresh(photo)
+
+        response = await client.get(url, headers=headers)
+        assert response.json()["processing_status"] == "done"
+        assert response.json()["face_count"] == 0
+
+    async def test_claim_photo(self, session, session_factory, user: UserRawPassword):
+        photo = await self.add_photo(session, user)
+        now = datetime.now(timezone.utc)
+        lease_start = now - timedelta(minutes=10)
+
+        async with session_factory() as first, session_factory() as second:
+            assert await PhotoStorage.claim_photo(first, photo.id, lease_start)
+            # claimed within its lease, other workers skip the photo
+            assert not await PhotoStorage.claim_photo(second, photo.id, lease_start)
+            unprocessed = await PhotoStorage.get_unprocessed_photo_ids(
+                second, lease_start
+            )
+            assert photo.id not in unprocessed
+
+            # the lease is over, the worker is taken to be gone
+            expired = now + timedelta(seconds=1)
+            unprocessed = await PhotoStorage.get_unprocessed_photo_ids(second, expired)
+            assert photo.id in unprocessed
+            assert await PhotoStorage.claim_photo(second, photo.id, expired)
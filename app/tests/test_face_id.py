@@ -0,0 +1,244 @@
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from app.face_id.clustering import assign_clusters
+from app.face_id.embedding_store import EmbeddingStore, StoreCursor
+from app.face_id.engine import FaceEngine
+from app.face_id.index import FaceIndex
+from app.face_id.prototypes import PrototypeRegistry, UserPrototype
+
+rng = np.random.default_rng(42)
+
+
+class TestUserPrototype:
+    def test_add_keeps_matrix_and_centroid(self):
+        encodings = rng.normal(0, 0.1, (20, 128))
+        prototype = UserPrototype(encodings[:3])
+        for encoding in encodings[3:]:
+            prototype.add(encoding)
+
+        assert np.allclose(prototype.matrix, encodings)
+        assert np.allclose(prototype.centroid, encodings.mean(axis=0))
+
+    def test_verify(self):
+        encodings = rng.normal(0, 0.1, (5, 128))
+        prototype = UserPrototype(encodings)
+
+        for centroid_first in (False, True):
+            assert prototype.verify(encodings[0] + 0.01, 0.6, centroid_first)
+            assert not prototype.verify(encodings[0] + 1, 0.6, centroid_first)
+
+    def test_verify_many_matches_verify(self):
+        encodings = rng.normal(0, 0.1, (5, 128))
+        prototype = UserPrototype(encodings)
+        candidates = np.concatenate(
+            [encodings + 0.01, encodings + 1, rng.normal(0, 0.1, (20, 128))]
+        )
+
+        for centroid_first in (False, True):
+            expected = [
+                prototype.verify(candidate, 0.6, centroid_first)
+                for candidate in candidates
+            ]
+            assert prototype.verify_many(candidates, 0.6, centroid_first).tolist() == (
+                expected
+            )
+
+    def test_empty_prototype_accepts_first_face(self):
+        assert UserPrototype([]).verify(rng.normal(0, 0.1, 128), 0.6)
+
+
+class TestPrototypeRegistry:
+    def test_lru_and_ttl(self):
+        registry = PrototypeRegistry(max_size=2, ttl=60)
+        for user_id in range(3):
+            registry.set(user_id, UserPrototype())
+
+        assert registry.get(0) is None and registry.get(2) is not None
+
+        registry.ttl = -1
+        assert registry.get(2) is None
+
+
+class TestFaceIndex:
+    @pytest.fixture
+    def faces(self):
+        centers = rng.normal(0, 0.35, (50, 128))
+        labels = np.repeat(np.arange(50), 10)
+        vectors = centers[labels] + rng.normal(0, 0.03, (500, 128))
+        return labels, vectors
+
+    @pytest.mark.parametrize("min_train_size", [10_000, 100])
+    def test_search(self, faces, min_train_size):
+        labels, vectors = faces
+        index = FaceIndex(nprobe=4, min_train_size=min_train_size)
+        index.build(np.arange(len(labels)), labels, vectors)
+
+        results = index.search(vectors[::10] + 0.01, k=3, max_distance=0.6)
+
+        assert [result[0].label for result in results] == list(labels[::10])
+
+    def test_nlist_larger_than_library(self, faces):
+        labels, vectors = faces
+        index = FaceIndex(nlist=1000, min_train_size=10)
+        index.build(np.arange(20), labels[:20], vectors[:20])
+
+        assert len(index.centroids) == 20
+        assert index.search(vectors[:1], k=1)[0][0].key == 0
+
+    def test_add_and_remove(self, faces):
+        labels, vectors = faces
+        index = FaceIndex(min_train_size=100)
+        for key, (label, vector) in enumerate(zip(labels, vectors)):
+            index.add(key, label, vector)
+        for key in range(0, len(labels), 2):
+            index.remove(key)
+
+        results = index.search(vectors[:4], k=1)
+
+        assert len(index) == len(labels) // 2
+        assert all(result[0].key % 2 and result[0].label == 0 for result in results)
+
+
+class TestEmbeddingStore:
+    def test_append_delete_and_compact(self, tmp_path):
+        vectors = rng.normal(0, 0.1, (10, 128))
+        writer, reader = EmbeddingStore(tmp_path), EmbeddingStore(tmp_path)
+        writer.rebuild(np.arange(5), np.zeros(5), vectors[:5])
+        writer.append(np.arange(5, 10), np.ones(5), vectors[5:])
+        writer.delete([0, 1, 2])
+
+        assert reader.refresh() and not reader.refresh()
+        ids, labels, live = reader.live()
+        assert isinstance(reader.vectors, np.memmap) and len(reader) == 10
+        assert ids.tolist() == list(range(3, 10))
+        assert np.allclose(live, vectors[3:], atol=1e-6)
+        assert reader.needs_compaction()
+
+        writer.compact()
+        assert reader.refresh() and len(reader) == 7 and not len(reader.tombstones)
+        assert reader.live()[0].tolist() == list(range(3, 10))
+
+    def test_append_after_partial_write(self, tmp_path):
+        vectors = rng.normal(0, 0.1, (4, 128))
+        store = EmbeddingStore(tmp_path)
+        store.rebuild(np.arange(2), [10, 11], vectors[:2])
+        # a writer died after its vectors and labels, before the ids
+        path = tmp_path / store.generation
+        with open(path / "vectors.f32", "ab") as file:
+            file.write(vectors[2].astype(np.float32).tobytes())
+        with open(path / "labels.i64", "ab") as file:
+            file.write(np.int64(12).tobytes())
+
+        store.append([3], [13], vectors[3:])
+        store.refresh()
+
+        assert store.ids.tolist() == [0, 1, 3] and store.labels.tolist()[2] == 13
+        assert np.allclose(store.vectors[2], vectors[3], atol=1e-6)
+
+    def test_superseded_generation_is_kept(self, monkeypatch, tmp_path):
+        vectors = rng.normal(0, 0.1, (3, 128))
+        writer, reader = EmbeddingStore(tmp_path), EmbeddingStore(tmp_path)
+        for _ in range(3):
+            writer.rebuild(np.arange(3), np.zeros(3), vectors)
+
+        generations = sorted(path.name for path in tmp_path.glob("gen-*"))
+        assert generations == ["gen-000002", "gen-000003"]
+
+        # CURRENT was read before the last two switches, the files are gone
+        read_generation = reader._read_generation
+        stale = iter(["gen-000001"])
+        monkeypatch.setattr(
+            reader, "_read_generation", lambda: next(stale, None) or read_generation()
+        )
+        assert reader.refresh() and reader.generation == "gen-000003"
+
+    def test_cursor_replays_appended_rows(self, tmp_path):
+        vectors = rng.normal(0, 0.1, (6, 128))
+        store, index, cursor = EmbeddingStore(tmp_path), FaceIndex(), StoreCursor()
+        store.rebuild(np.arange(3), np.zeros(3), vectors[:3])
+        cursor.apply(store, index)
+
+        store.append(np.arange(3, 6), np.ones(3), vectors[3:])
+        store.delete([0])
+        store.refresh()
+        cursor.apply(store, index)
+
+        assert len(index) == 5
+        assert index.search(vectors[4], k=1)[0][0].key == 4
+        assert index.search(vectors[0], k=1)[0][0].key != 0
+
+    def test_index_searches_the_store_in_place(self, tmp_path):
+        labels = np.repeat(np.arange(50), 10)
+        vectors = rng.normal(0, 0.35, (50, 128))[labels] + rng.normal(
+            0, 0.03, (500, 128)
+        )
+        layout = FaceIndex(min_train_size=100)
+        store = EmbeddingStore(tmp_path, index=layout)
+        index, cursor = FaceIndex(nprobe=4), StoreCursor()
+        store.rebuild(np.arange(400), labels[:400], vectors[:400])
+        cursor.apply(store, index)
+
+        # the buckets are the ones written with the generation, not retrained
+        assert isinstance(index.vectors, np.memmap) and len(index.centroids) == 20
+        assert np.array_equal(index.centroids, store.centroids)
+
+        store.append(np.arange(400, 500), labels[400:], vectors[400:])
+        store.delete([400, 0])
+        store.refresh()
+        cursor.apply(store, index)
+
+        results = index.search(vectors[[0, 401, 450]] + 0.01, k=1)
+        assert isinstance(index.vectors, np.memmap) and len(index) == 498
+        assert [result[0].key for result in results][1:] == [401, 450]
+        assert results[0][0].key != 0 and results[0][0].label == labels[0]
+        # 500 rows are still within twice the 400 laid out
+        assert not store.needs_compaction()
+
+        store.append(np.arange(500, 800), labels[:300], vectors[:300])
+        store.refresh()
+        assert store.needs_compaction()
+
+
+def test_assign_clusters_is_incremental():
+    people = rng.normal(0, 0.1, (3, 128))
+    faces = np.repeat(people, 4, axis=0) + rng.normal(0, 0.01, (12, 128))
+    first, rest = faces[::2], faces[1::2]
+
+    positions, centroids, sizes = assign_clusters(
+        first, np.empty((0, 128)), np.empty(0), tolerance=0.5
+    )
+    assert positions.tolist() == [0, 0, 1, 1, 2, 2] and sizes.tolist() == [2, 2, 2]
+
+    # later faces join the clusters found so far, a stranger starts a new one
+    stranger = rng.normal(0, 0.1, (1, 128))
+    positions, centroids, sizes = assign_clusters(
+        np.vstack([rest, stranger]), centroids, sizes, tolerance=0.5
+    )
+    assert positions.tolist() == [0, 0, 1, 1, 2, 2, 3]
+    assert sizes.tolist() == [4, 4, 4, 1]
+    assert np.allclose(centroids[0], faces[:4].mean(axis=0))
+
+
+def test_app_import_does_not_load_face_stack():
+    # dlib is loaded only by the face engine workers
+    code = (
+        "import sys; import app.main; "
+        "print(sorted({'face_recognition', 'dlib'} & set(sys.modules)))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout
+
+    assert output.strip() == "[]"
+
+
+async def test_face_engine_warmup():
+    engine = FaceEngine(max_workers=1, max_concurrency=1)
+    try:
+        assert await engine.warmup() == 1
+    finally:
+        await engine.shutdown()
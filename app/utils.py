@@ -1,3 +1,5 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 
 from jose import jwt
@@ -5,15 +7,38 @@ from passlib.context import CryptContext
 
 from app.core.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS
+)
+
+# bcrypt releases the GIL, so hashing scales with threads without blocking the loop
+password_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt"
+)
 
 
 async def verify_password(plain_password: str, hashed_password: str):
-    return pwd_context.verify(plain_password, hashed_password)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        password_executor, pwd_context.verify, plain_password, hashed_password
+    )
+
+
+async def verify_and_update_password(
+    plain_password: str, hashed_password: str
+) -> tuple[bool, str | None]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        password_executor,
+        pwd_context.verify_and_update,
+        plain_password,
+        hashed_password,
+    )
 
 
 async def get_password_hash(password: str):
-    return pwd_context.hash(password)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, pwd_context.hash, password)
 
 
 async def create_access_token(data: dict, expires_delta: timedelta | None = None):